@@ -0,0 +1,186 @@
+"""
+End to end run of the component against the local WooCommerce stub, reporting throughput, peak memory and the time
+spent in each stage. The stub runs in a separate process so the peak RSS belongs to the component only.
+
+    python benchmarks/bench_component.py --orders 20000 --products 5000 --customers 5000 --latency 0.02 \
+        --error-rate 0.01 --option concurrency=4 --option pipelined_writes=true
+
+Stage times are summed over all threads, with concurrent downloads they may exceed the wall time.
+"""
+import argparse
+import csv
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+
+from stub_server import WooCommerceStub  # noqa: E402
+
+
+class StageTimer:
+    """
+    Sums the time spent in the wrapped functions per stage, nested calls of the same stage are counted once
+    """
+
+    def __init__(self):
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self._lock = threading.Lock()
+        self._active = threading.local()
+
+    def wrap(self, owner, name, stage):
+        fnc = getattr(owner, name)
+        timer = self
+
+        @functools.wraps(fnc)
+        def timed(*args, **kwargs):
+            active = getattr(timer._active, "stages", set())
+            if stage in active:
+                return fnc(*args, **kwargs)
+            timer._active.stages = active | {stage}
+            start = time.perf_counter()
+            try:
+                return fnc(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                timer._active.stages = active
+                with timer._lock:
+                    timer.times[stage] += elapsed
+                    timer.calls[stage] += 1
+
+        setattr(owner, name, timed)
+
+
+def run_stub(options, urls, stop):
+    with WooCommerceStub(**options) as stub:
+        urls.put(stub.url)
+        stop.wait()
+
+
+def parse_option(option):
+    key, value = option.split("=", 1)
+    return key, json.loads(value)
+
+
+def write_config(data_dir, url, args):
+    for folder in ("in", "out/tables", "out/files"):
+        os.makedirs(os.path.join(data_dir, folder), exist_ok=True)
+    config = {
+        "parameters": {
+            "store_url": url,
+            "#consumer_key": "ck_benchmark",
+            "#consumer_secret": "cs_benchmark",
+            "endpoint": args.endpoints,
+            "fetching_mode": "Full Download",
+            "load_type": False,
+            "additional_options": dict(args.option)
+        }
+    }
+    with open(os.path.join(data_dir, "config.json"), "w") as config_file:
+        json.dump(config, config_file)
+
+
+def count_rows(tables_dir):
+    rows = 0
+    for name in os.listdir(tables_dir):
+        if not name.endswith(".csv"):
+            continue
+        with open(os.path.join(tables_dir, name), newline="", encoding="utf-8") as table:
+            rows += sum(1 for _ in csv.reader(table))
+        with open(os.path.join(tables_dir, name + ".manifest")) as manifest:
+            if not json.load(manifest).get("columns"):
+                # the columns are in the header row
+                rows -= 1
+    return rows
+
+
+def instrument():
+    import component
+    import result
+    import woocommerce_cli
+
+    timer = StageTimer()
+    timer.wrap(woocommerce_cli.WooCommerceClient, "_get", "fetch")
+    # pages are decoded with orjson from the response content, not by Response.json
+    timer.wrap(woocommerce_cli.WooCommerceClient, "_decode", "decode")
+    for writer in (result.OrdersWriter, result.ProductsWriter, result.CustomersWriter):
+        timer.wrap(writer, "write", "write")
+    timer.wrap(component.Component, "write_state_file", "finalize")
+    timer.wrap(component.Component, "create_manifests", "finalize")
+    return timer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=10000)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--customers", type=int, default=2000)
+    parser.add_argument("--endpoints", nargs="+", default=["Orders", "Products", "Customers"])
+    parser.add_argument("--latency", type=float, default=0.0, help="server side latency per request in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of requests failing with 429 or 500, the failed requests are retried")
+    parser.add_argument("--option", type=parse_option, action="append", default=[],
+                        help="additional_options entry as key=json_value, e.g. concurrency=4")
+    parser.add_argument("--min-rows-per-second", type=float, default=0.0,
+                        help="exit with an error when the throughput is lower, for use in CI")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    stub_options = {
+        "total_records": {"orders": args.orders, "products": args.products, "customers": args.customers},
+        "latency": args.latency,
+        "error_rate": args.error_rate
+    }
+    urls = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    stub = multiprocessing.Process(target=run_stub, args=(stub_options, urls, stop), daemon=True)
+    stub.start()
+    url = urls.get(timeout=30)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_config(data_dir, url, args)
+        os.environ["KBC_DATADIR"] = data_dir
+        timer = instrument()
+        from component import Component
+
+        # including the authentication check
+        start = time.perf_counter()
+        Component().run()
+        wall_time = time.perf_counter() - start
+        rows = count_rows(os.path.join(data_dir, "out", "tables"))
+
+    stats = requests.get(f"{url}/wp-json/wc/v3/stats").json()
+    stop.set()
+    stub.join()
+
+    # kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    rows_per_second = rows / wall_time
+    print(f"wall time        {wall_time:10.2f} s")
+    print(f"pages            {stats['pages']:10} {stats['pages'] / wall_time:10.1f} pages/s")
+    print(f"rows             {rows:10} {rows_per_second:10.1f} rows/s")
+    print(f"requests         {stats['requests']:10} {stats['errors']:6} injected errors "
+          f"{stats['connections']:6} connections")
+    print(f"peak RSS         {peak_rss:10.1f} MB")
+    for stage in ("fetch", "decode", "write", "finalize"):
+        print(f"{stage:16} {timer.times[stage]:10.2f} s {timer.calls[stage]:10} calls")
+
+    if rows_per_second < args.min_rows_per_second:
+        print(f"Throughput {rows_per_second:.1f} rows/s is below {args.min_rows_per_second} rows/s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
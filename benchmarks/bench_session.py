@@ -0,0 +1,53 @@
+"""
+Per page latency of woocommerce.API, which opens a new connection for every request,
+compared to PooledAPI keeping the connections alive.
+
+    python benchmarks/bench_session.py --pages 200 --latency 0.005 --connect-latency 0.03 --tls
+"""
+import argparse
+import os
+import sys
+import time
+
+import urllib3
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+
+from woocommerce import API  # noqa: E402
+
+from stub_server import WooCommerceStub  # noqa: E402
+from woocommerce_cli import PooledAPI  # noqa: E402
+
+
+def measure(api, pages):
+    start = time.perf_counter()
+    for page in range(1, pages + 1):
+        response = api.get("orders", params={"per_page": 100, "page": page})
+        response.raise_for_status()
+        response.json()
+    return (time.perf_counter() - start) / pages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0, help="server side latency per request in seconds")
+    parser.add_argument("--connect-latency", type=float, default=0.0,
+                        help="simulated network round trips of a new connection in seconds")
+    parser.add_argument("--tls", action="store_true", help="serve https with a self-signed certificate")
+    args = parser.parse_args()
+
+    if args.tls:
+        urllib3.disable_warnings()
+    for name, api_class in (("woocommerce.API", API), ("PooledAPI", PooledAPI)):
+        with WooCommerceStub(total_records=args.pages * 100, latency=args.latency,
+                             connect_latency=args.connect_latency, tls=args.tls) as stub:
+            api = api_class(stub.url, "ck_benchmark", "cs_benchmark", version="wc/v3", timeout=30, verify_ssl=False)
+            per_page = measure(api, args.pages)
+            print(f"{name:16} {per_page * 1000:8.2f} ms/page {stub.connections:5} connections "
+                  f"for {stub.requests} requests")
+
+
+if __name__ == "__main__":
+    main()
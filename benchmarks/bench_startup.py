@@ -0,0 +1,42 @@
+"""
+Startup time of the authentication check, downloading the wc/v3 route index compared to the single order id probe.
+
+    python benchmarks/bench_startup.py --routes 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+
+from stub_server import WooCommerceStub  # noqa: E402
+from woocommerce_cli import PooledAPI, WooCommerceClient  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--routes", type=int, default=2000, help="number of routes in the route index")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    with WooCommerceStub(index_routes=args.routes) as stub:
+        api = PooledAPI(stub.url, "ck_benchmark", "cs_benchmark", version="wc/v3", timeout=30)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            response = api.get("")
+            response.raise_for_status()
+            response.json()
+        index_time = (time.perf_counter() - start) / args.repeat
+        print(f"route index      {index_time * 1000:8.2f} ms {len(response.content) / 1e6:6.2f} MB")
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            WooCommerceClient(stub.url, "ck_benchmark", "cs_benchmark")
+        probe_time = (time.perf_counter() - start) / args.repeat
+        print(f"order id probe   {probe_time * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""
+Local stub of the WooCommerce wc/v3 REST API used by the benchmarks.
+
+Serves synthetic orders, products and customers with the nesting of real stores (line items with taxes and
+meta_data, refunds, product images and attributes, ...). Supports the query parameters used by the component:
+per_page, page, offset, order, after, before, modified_after, include and _fields. The stats route returns the request
+counters, for stubs running in another process.
+"""
+import datetime
+import json
+import math
+import os
+import random
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# record n is created n * RECORD_INTERVAL after START_DATE
+START_DATE = datetime.datetime(2020, 1, 1)
+RECORD_INTERVAL = datetime.timedelta(minutes=10)
+
+LOREM = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore. "
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    # keep-alive requires HTTP/1.1 and a Content-Length on every response
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, Nagle's algorithm would delay the body on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.stub.count_connection()
+        if self.server.stub.connect_latency:
+            # round trips of the TCP and TLS handshakes on a real network
+            time.sleep(self.server.stub.connect_latency)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        path = url.path.rstrip("/").split("/")
+        endpoint = path[-1]
+        if endpoint == "variations":
+            # products/<id>/variations
+            query["parent"] = path[-2]
+        status, headers, body = self.server.stub.handle(endpoint, query)
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in headers.items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WooCommerceStub:
+    """
+    Serves synthetic pages of the orders, products and customers endpoints on a random local port.
+
+    total_records: number of records of each endpoint, int or dict endpoint -> int
+    latency: server side latency of every request in seconds
+    record_latency: additional latency per served record in seconds, heavy records make large pages slow
+    max_per_page: larger pages are rejected with 400 as by WooCommerce
+    connect_latency: latency of every new connection in seconds
+    error_rate: share of page requests failing with one of error_statuses, 429 responses carry Retry-After: 0
+    """
+
+    def __init__(self, total_records=1000, latency=0.0, connect_latency=0.0, tls=False, index_routes=500,
+                 error_rate=0.0, error_statuses=(429, 500), seed=0, record_latency=0.0, max_per_page=100):
+        if isinstance(total_records, int):
+            total_records = {"orders": total_records, "products": total_records, "customers": total_records}
+        self.total_records = total_records
+        self.index_routes = index_routes
+        self.latency = latency
+        self.record_latency = record_latency
+        self.max_per_page = max_per_page
+        self.connect_latency = connect_latency
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.connections = 0
+        self.requests = 0
+        self.pages = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubRequestHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        scheme = "http"
+        if tls:
+            scheme = "https"
+            self.server.socket = self._tls_context().wrap_socket(self.server.socket, server_side=True)
+        self.url = f"{scheme}://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def _tls_context():
+        """
+        TLS context with a throwaway self-signed certificate, clients need to disable certificate verification
+        """
+        with tempfile.TemporaryDirectory() as cert_dir:
+            certfile = os.path.join(cert_dir, "cert.pem")
+            keyfile = os.path.join(cert_dir, "key.pem")
+            subprocess.run(
+                ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+                 "-keyout", keyfile, "-out", certfile],
+                check=True, capture_output=True
+            )
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+        return context
+
+    def count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def stats(self):
+        return {"connections": self.connections, "requests": self.requests, "pages": self.pages,
+                "errors": self.errors}
+
+    def handle(self, endpoint, query):
+        if endpoint == "stats":
+            return 200, {}, self.stats()
+        with self._lock:
+            self.requests += 1
+            failure = self.error_rate and endpoint != "v3" and self._random.random() < self.error_rate
+            if failure:
+                self.errors += 1
+                status = self._random.choice(self.error_statuses)
+        if self.latency:
+            time.sleep(self.latency)
+        if failure:
+            headers = {"Retry-After": 0} if status == 429 else {}
+            return status, headers, {"code": "stub_error", "message": "Injected failure", "data": {"status": status}}
+        if endpoint == "v3":
+            return 200, {}, self.index()
+        if endpoint not in self.total_records and endpoint != "variations":
+            return 404, {}, {"code": "rest_no_route", "message": "No route was found", "data": {"status": 404}}
+
+        ids = self.matching_ids(endpoint, query)
+        per_page = int(query.get("per_page", 10))
+        if not 0 < per_page <= self.max_per_page:
+            return 400, {}, {"code": "rest_invalid_param", "message": "Invalid parameter(s): per_page",
+                             "data": {"status": 400}}
+        page = int(query.get("page", 1))
+        total_pages = max(1, math.ceil(len(ids) / per_page))
+        if page > total_pages:
+            return 400, {}, {"code": "rest_post_invalid_page_number", "message": "Invalid page number",
+                             "data": {"status": 400}}
+        # the offset takes precedence over the page
+        offset = int(query.get("offset") or (page - 1) * per_page)
+        page_ids = ids[offset:offset + per_page]
+        if self.record_latency and query.get("_fields") != "id":
+            time.sleep(self.record_latency * len(page_ids))
+        if endpoint == "variations":
+            records = [self.variation(record_id, int(query["parent"])) for record_id in page_ids]
+        else:
+            records = [self.record(endpoint, record_id) for record_id in page_ids]
+        if per_page > 1:
+            # record count probes are not pages
+            with self._lock:
+                self.pages += 1
+        if query.get("_fields"):
+            fields = query["_fields"].split(",")
+            records = [{key: value for key, value in record.items() if key in fields} for record in records]
+        return 200, {"X-WP-Total": len(ids), "X-WP-TotalPages": total_pages}, records
+
+    def matching_ids(self, endpoint, query):
+        """
+        Ids of the records matching the query, dates grow with the id so the date filters select an id range
+        """
+        if endpoint == "variations":
+            return self.variation_ids(int(query["parent"]))
+        first, last = 1, self.total_records[endpoint]
+        for key in ("after", "modified_after"):
+            if query.get(key):
+                first = max(first, math.floor(self._position(query[key])) + 1)
+        if query.get("before"):
+            last = min(last, math.ceil(self._position(query["before"])) - 1)
+        ids = range(first, last + 1)
+        if query.get("include"):
+            include = {int(record_id) for record_id in query["include"].split(",")}
+            ids = [record_id for record_id in ids if record_id in include]
+        ids = list(ids)
+        if query.get("order", "desc") == "desc":
+            ids.reverse()
+        return ids
+
+    @staticmethod
+    def _position(date):
+        return (datetime.datetime.fromisoformat(date) - START_DATE) / RECORD_INTERVAL
+
+    @staticmethod
+    def date(record_id):
+        return (START_DATE + record_id * RECORD_INTERVAL).isoformat()
+
+    def index(self):
+        """
+        wc/v3 route index, on stores with many plugins it lists hundreds of routes with their full argument schemas
+        """
+        args = {f"arg_{i}": {"description": LOREM[:100], "type": "string", "required": False} for i in range(20)}
+        return {
+            "namespace": "wc/v3",
+            "routes": {
+                f"/wc/v3/route_{i}": {"methods": ["GET", "POST"], "endpoints": [{"methods": ["GET"], "args": args}]}
+                for i in range(self.index_routes)
+            }
+        }
+
+    @staticmethod
+    def variation_ids(product_id):
+        # every fifth product is variable
+        return [product_id * 100 + i for i in range(2)] if product_id % 5 == 0 else []
+
+    def record(self, endpoint, record_id):
+        return getattr(self, endpoint[:-1])(record_id)
+
+    @staticmethod
+    def meta_data(record_id, count):
+        meta_data = [{"id": record_id * 100 + i, "key": f"_plugin_key_{i}", "value": f"value {i}"}
+                     for i in range(count - 1)]
+        meta_data.append({"id": record_id * 100 + count, "key": "_plugin_blob",
+                          "value": {"settings": {"enabled": True, "items": [1, 2, 3]}, "note": LOREM[:60]}})
+        return meta_data
+
+    @staticmethod
+    def address(record_id):
+        return {
+            "first_name": f"First {record_id}", "last_name": f"Last {record_id}", "company": "",
+            "address_1": f"{record_id} Main Street", "address_2": "", "city": "Prague", "state": "",
+            "postcode": "11000", "country": "CZ", "email": f"customer{record_id}@example.com", "phone": "+420123456789"
+        }
+
+    def order(self, record_id):
+        date = self.date(record_id)
+        taxes = [{"id": 1, "total": "2.10", "subtotal": "2.10"}]
+        return {
+            "id": record_id, "parent_id": 0, "number": str(record_id), "order_key": f"wc_order_{record_id:012d}",
+            "created_via": "checkout", "version": "8.0.0", "status": "completed", "currency": "EUR",
+            "date_created": date, "date_created_gmt": date, "date_modified": date, "date_modified_gmt": date,
+            "discount_total": "0.00", "discount_tax": "0.00", "shipping_total": "5.00", "shipping_tax": "1.05",
+            "cart_tax": "6.30", "total": "41.35", "total_tax": "7.35", "prices_include_tax": False,
+            "customer_id": record_id % 500, "customer_ip_address": "127.0.0.1",
+            "customer_user_agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko)",
+            "customer_note": "", "billing": self.address(record_id), "shipping": self.address(record_id),
+            "payment_method": "bacs", "payment_method_title": "Direct bank transfer", "transaction_id": "",
+            "date_paid": date, "date_paid_gmt": date, "date_completed": date, "date_completed_gmt": date,
+            "cart_hash": "0" * 32, "meta_data": self.meta_data(record_id, 5),
+            "line_items": [
+                {
+                    "id": record_id * 10 + i, "name": f"Product {i}", "product_id": i, "variation_id": 0,
+                    "quantity": 1, "tax_class": "", "subtotal": "10.00", "subtotal_tax": "2.10", "total": "10.00",
+                    "total_tax": "2.10", "taxes": taxes, "meta_data": self.meta_data(record_id * 10 + i, 2),
+                    "sku": f"SKU-{i}", "price": 10, "image": {"id": i, "src": f"https://myshop.com/{i}.jpg"}
+                }
+                for i in range(3)
+            ],
+            "tax_lines": [{"id": record_id, "rate_code": "CZ-VAT-1", "rate_id": 1, "label": "VAT", "compound": False,
+                           "tax_total": "6.30", "shipping_tax_total": "1.05", "meta_data": []}],
+            "shipping_lines": [{"id": record_id, "method_title": "Flat rate", "method_id": "flat_rate",
+                                "total": "5.00", "total_tax": "1.05", "taxes": taxes,
+                                "meta_data": self.meta_data(record_id, 1)}],
+            "fee_lines": [],
+            "coupon_lines": [{"id": record_id, "code": "sale", "discount": "0.00", "discount_tax": "0.00",
+                              "meta_data": []}],
+            "refunds": [{"id": record_id, "reason": "Damaged", "total": "-5.00"}] if record_id % 10 == 0 else [],
+            "_links": {"self": [{"href": f"https://myshop.com/wp-json/wc/v3/orders/{record_id}"}]}
+        }
+
+    def product(self, record_id):
+        date = self.date(record_id)
+        return {
+            "id": record_id, "name": f"Product {record_id}", "slug": f"product-{record_id}",
+            "permalink": f"https://myshop.com/product/product-{record_id}", "date_created": date,
+            "date_created_gmt": date, "date_modified": date, "date_modified_gmt": date,
+            "type": "variable" if record_id % 5 == 0 else "simple", "status": "publish", "featured": False,
+            "catalog_visibility": "visible", "description": f"<p>{LOREM * 20}</p>",
+            "short_description": f"<p>{LOREM}</p>", "sku": f"SKU-{record_id}", "price": "10", "regular_price": "10",
+            "sale_price": "", "on_sale": False, "purchasable": True, "total_sales": record_id % 100,
+            "virtual": False, "downloadable": False, "downloads": [], "tax_status": "taxable", "manage_stock": True,
+            "stock_quantity": 10, "stock_status": "instock", "weight": "1",
+            "dimensions": {"length": "10", "width": "10", "height": "10"}, "related_ids": [1, 2, 3],
+            "categories": [{"id": 1, "name": "Clothing", "slug": "clothing"}],
+            "tags": [{"id": 1, "name": "sale", "slug": "sale"}],
+            "images": [{"id": record_id * 10 + i, "src": f"https://myshop.com/{record_id}-{i}.jpg", "name": "",
+                        "alt": ""} for i in range(3)],
+            "attributes": [{"id": 1, "name": "Color", "position": 0, "visible": True, "variation": True,
+                            "options": ["Red", "Blue"]}],
+            "default_attributes": [], "variations": self.variation_ids(record_id),
+            "meta_data": self.meta_data(record_id, 4),
+            "_links": {"self": [{"href": f"https://myshop.com/wp-json/wc/v3/products/{record_id}"}]}
+        }
+
+    def customer(self, record_id):
+        date = self.date(record_id)
+        return {
+            "id": record_id, "date_created": date, "date_created_gmt": date, "date_modified": date,
+            "date_modified_gmt": date, "email": f"customer{record_id}@example.com",
+            "first_name": f"First {record_id}", "last_name": f"Last {record_id}", "role": "customer",
+            "username": f"customer{record_id}", "billing": self.address(record_id),
+            "shipping": self.address(record_id), "is_paying_customer": True,
+            "avatar_url": "https://secure.gravatar.com/avatar/0", "meta_data": self.meta_data(record_id, 3),
+            "_links": {"self": [{"href": f"https://myshop.com/wp-json/wc/v3/customers/{record_id}"}]}
+        }
+
+    def variation(self, record_id, product_id):
+        date = self.date(product_id)
+        return {
+            "id": record_id, "date_created": date, "date_created_gmt": date, "date_modified": date,
+            "date_modified_gmt": date, "description": f"<p>{LOREM}</p>",
+            "permalink": f"https://myshop.com/product/product-{product_id}?attribute_color=red",
+            "sku": f"SKU-{product_id}-{record_id}", "price": "10", "regular_price": "10", "sale_price": "",
+            "on_sale": False, "status": "publish", "purchasable": True, "virtual": False, "downloadable": False,
+            "downloads": [], "tax_status": "taxable", "manage_stock": True, "stock_quantity": 5,
+            "stock_status": "instock", "weight": "1", "dimensions": {"length": "10", "width": "10", "height": "10"},
+            "image": {"id": record_id, "src": f"https://myshop.com/{product_id}-{record_id}.jpg"},
+            "attributes": [{"id": 1, "name": "Color", "option": "Red" if record_id % 2 else "Blue"}],
+            "menu_order": 0, "meta_data": self.meta_data(record_id, 2),
+            "_links": {"self": [{"href": f"https://myshop.com/wp-json/wc/v3/products/{product_id}/variations/"
+                                         f"{record_id}"}]}
+        }
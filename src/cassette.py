@@ -0,0 +1,114 @@
+import gzip
+import json
+import logging
+import threading
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+RECORD = "record"
+REPLAY = "replay"
+
+# query parameters that differ between stores or runs without changing the response
+IGNORED_PARAMS = ("consumer_key", "consumer_secret")
+
+
+class CassetteError(Exception):
+    pass
+
+
+def request_key(endpoint: str, params: dict) -> str:
+    params = {key: value for key, value in (params or {}).items() if key not in IGNORED_PARAMS}
+    return json.dumps([endpoint, params], sort_keys=True, default=str)
+
+
+class Cassette:
+    """
+    Gzip compressed JSON lines archive of raw API responses. In record mode the successful responses are appended
+    with their status, headers and body. In replay mode the responses are served from the archive by endpoint and
+    query parameters, so a download can be repeated without network access, e.g. to profile the result writers.
+    Replay needs the same configuration as the recording, including a fixed date period.
+    """
+
+    def __init__(self, path: str, mode: str):
+        if mode not in (RECORD, REPLAY):
+            raise CassetteError(f"Unknown cassette mode {mode}, use {RECORD} or {REPLAY}")
+        self.path = path
+        self.mode = mode
+        self.responses = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if mode == RECORD:
+            self._file = gzip.open(path, "wt", encoding="utf-8")
+            logging.info(f"Recording API responses to {path}")
+        else:
+            self._load()
+            logging.info(f"Replaying {len(self.responses)} API responses from {path}")
+
+    def _load(self):
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as cassette:
+                for line in cassette:
+                    entry = json.loads(line)
+                    self.responses[request_key(entry["endpoint"], entry["params"])] = entry
+        except (OSError, ValueError, KeyError) as err:
+            raise CassetteError(f"Failed to read the cassette {self.path}: {err}") from err
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == REPLAY
+
+    def record(self, endpoint: str, params: dict, response: requests.Response):
+        params = {key: value for key, value in (params or {}).items() if key not in IGNORED_PARAMS}
+        entry = {
+            "endpoint": endpoint,
+            "params": params,
+            "status": response.status_code,
+            "headers": dict(response.headers),
+            "body": response.text
+        }
+        line = json.dumps(entry, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def play(self, endpoint: str, params: dict) -> requests.Response:
+        entry = self.responses.get(request_key(endpoint, params))
+        if entry is None:
+            raise CassetteError(f"Request of {endpoint} with {params} is not recorded in the cassette {self.path}")
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = entry["body"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = endpoint
+        response.reason = "OK"
+        return response
+
+    def close(self):
+        if self._file:
+            with self._lock:
+                self._file.close()
+                self._file = None
+
+
+class CassetteSession:
+    """
+    Session of WooCommerceClient recording the responses of the wrapped session, or replaying them without one
+    """
+
+    def __init__(self, cassette: Cassette, session=None):
+        self.cassette = cassette
+        self.session = session
+
+    def get(self, endpoint, params=None, **kwargs):
+        if self.cassette.replaying:
+            return self.cassette.play(endpoint, params)
+        response = self.session.get(endpoint, params=params, **kwargs)
+        # failed requests are retried, only the final responses are replayed
+        if response.status_code < 400:
+            self.cassette.record(endpoint, params, response)
+        return response
+
+    def close(self):
+        if self.session:
+            self.session.close()
@@ -0,0 +1,101 @@
+import datetime
+import hashlib
+import json
+import logging
+import time
+
+
+def config_fingerprint(params: dict) -> str:
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ExtractionCheckpoint:
+    """
+    Progress of a single endpoint download stored in the state file. Downloads are tracked either by completed
+    date windows or by completed pages. An unfinished download of the previous run with the same configuration
+    is resumed with its original period, skipping the completed work.
+    """
+
+    def __init__(
+            self,
+            endpoint: str,
+            fingerprint: str,
+            previous: dict = None,
+            deadline: float = None,
+            date_from: str = None,
+            date_to: str = None,
+            custom_incremental_date: str = None
+    ):
+        previous = previous or {}
+        self.endpoint = endpoint
+        self.fingerprint = fingerprint
+        self.deadline = deadline
+        self.resumed = previous.get("fingerprint") == fingerprint and not previous.get("finished", True)
+        self.finished = False
+        if self.resumed:
+            self.date_from = previous.get("date_from")
+            self.date_to = previous.get("date_to")
+            self.custom_incremental_date = previous.get("custom_incremental_date")
+            self.completed_windows = [
+                (datetime.datetime.fromisoformat(start), datetime.datetime.fromisoformat(end))
+                for start, end in previous.get("completed_windows", [])
+            ]
+            self.completed_pages = previous.get("completed_pages", 0)
+            logging.info(f"Resuming unfinished {endpoint} download: {len(self.completed_windows)} completed "
+                         f"date ranges, {self.completed_pages} completed pages")
+        else:
+            self.date_from = date_from
+            self.date_to = date_to
+            self.custom_incremental_date = custom_incremental_date
+            self.completed_windows = []
+            self.completed_pages = 0
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def complete_page(self, page: int):
+        self.completed_pages = max(self.completed_pages, page)
+
+    def complete_window(self, start: datetime.datetime, end: datetime.datetime):
+        merged = []
+        for window_start, window_end in sorted(self.completed_windows + [(start, end)]):
+            if merged and window_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], window_end))
+            else:
+                merged.append((window_start, window_end))
+        self.completed_windows = merged
+
+    def remaining_ranges(self, date_from: datetime.datetime, date_to: datetime.datetime):
+        """
+        Returns the parts of [date_from, date_to) not covered by the completed windows
+        """
+        ranges = []
+        cursor = date_from
+        for start, end in self.completed_windows:
+            if end <= cursor or start >= date_to:
+                continue
+            if start > cursor:
+                ranges.append((cursor, start))
+            cursor = max(cursor, end)
+        if cursor < date_to:
+            ranges.append((cursor, date_to))
+        return ranges
+
+    def finish(self):
+        self.finished = True
+
+    def stop(self):
+        logging.warning(f"Maximum run time reached, the {self.endpoint} download will continue in the next run")
+
+    def to_state(self) -> dict:
+        if self.finished:
+            return {"fingerprint": self.fingerprint, "finished": True}
+        return {
+            "fingerprint": self.fingerprint,
+            "finished": False,
+            "date_from": self.date_from,
+            "date_to": self.date_to,
+            "custom_incremental_date": self.custom_incremental_date,
+            "completed_windows": [[start.isoformat(), end.isoformat()] for start, end in self.completed_windows],
+            "completed_pages": self.completed_pages
+        }
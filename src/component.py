@@ -3,16 +3,28 @@ Template Component main class.
 
 """
 import datetime
+import functools
 import logging
 import os
 import sys
+import time
 import dateparser
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from kbc.env_handler import KBCEnvHandler
 
-from result import OrdersWriter, CustomersWriter, ProductsWriter
-from woocommerce_cli import WooCommerceClient, error_handling
+from cassette import Cassette, CassetteError, RECORD
+from checkpoint import ExtractionCheckpoint, config_fingerprint
+from fingerprints import FingerprintStore, DEFAULT_MAX_FINGERPRINTS, DEFAULT_REFRESH_DAYS
+from metrics import RunMetrics
+from rate_limiter import AdaptiveRateLimiter
+from record_ids import IdSet, decode_ids, encode_ids
+from result import OrdersWriter, CustomersWriter, ProductsWriter, NdjsonWriter, DeletedRecordsWriter, \
+    METADATA_MAX_DEPTH, METADATA_MAX_COLUMNS, OVERFLOW_COLUMN
+from slicing import slice_table, DEFAULT_SLICE_SIZE_MB
+from woocommerce_cli import WooCommerceClient, DEFAULT_CONCURRENCY, DEFAULT_MAX_WINDOW_RECORDS, DEFAULT_FIELDS, \
+    prefetch, release_records
 
 # configuration variables
 STORE_URL = "store_url"
@@ -27,9 +39,72 @@ KEY_INCREMENTAL = "load_type"
 KEY_FETCHING_MODE = "fetching_mode"
 KEY_CUSTOM_INCREMENTAL_FIELD = "custom_incremental_field"
 KEY_CUSTOM_INCREMENTAL_VALUE = "custom_incremental_value"
-# params for compatibility with old version that had flatten_metadata option which could cause oom
+KEY_MODIFIED_LAG = "modified_lag_minutes"
+# params for compatibility with old version that had flatten_metadata option, the flattening is now bounded
 KEY_ADDITIONAL_OPTIONS = "additional_options"
 KEY_FLATTEN_METADATA = "flatten_metadata_values"
+# performance tuning options, also nested in additional_options
+KEY_CONCURRENCY = "concurrency"
+KEY_PARALLEL_ENDPOINTS = "parallel_endpoints"
+KEY_DATE_WINDOW_SHARDING = "date_window_sharding"
+KEY_MAX_WINDOW_RECORDS = "max_window_records"
+KEY_RESUMABLE_EXTRACTION = "resumable_extraction"
+KEY_MAX_RUN_TIME = "max_run_time"
+KEY_FIELDS_PROJECTION = "fields_projection"
+KEY_FIELDS = "fields"
+KEY_PIPELINED_WRITES = "pipelined_writes"
+KEY_PIPELINE_BUFFER_PAGES = "pipeline_buffer_pages"
+KEY_CASSETTE_MODE = "cassette_mode"
+KEY_CASSETTE_PATH = "cassette_path"
+KEY_ADAPTIVE_RATE_LIMIT = "adaptive_rate_limit"
+KEY_MAX_REQUESTS_PER_SECOND = "max_requests_per_second"
+KEY_ADAPTIVE_PAGE_SIZE = "adaptive_page_size"
+KEY_PRODUCT_VARIATIONS = "product_variations"
+KEY_VARIATIONS_CONCURRENCY = "variations_concurrency"
+KEY_OUTPUT_FORMAT = "output_format"
+KEY_SLICED_OUTPUT = "sliced_output"
+KEY_SLICE_SIZE_MB = "slice_size_mb"
+KEY_SLICE_ROWS = "slice_rows"
+KEY_DETECT_DELETED = "detect_deleted"
+KEY_INCREMENTAL_CUSTOMERS = "incremental_customers"
+KEY_CUSTOMERS_FULL_SWEEP_DAYS = "customers_full_sweep_days"
+KEY_SKIP_UNCHANGED = "skip_unchanged_records"
+KEY_FINGERPRINT_MAX_RECORDS = "fingerprint_max_records"
+KEY_FINGERPRINT_REFRESH_DAYS = "fingerprint_refresh_days"
+KEY_STATUS_SHARDING = "status_sharding"
+
+# state keys
+KEY_CHECKPOINTS = "checkpoints"
+KEY_MODIFIED_CURSORS = "modified_cursors"
+KEY_RECORD_IDS = "record_ids"
+KEY_CUSTOMERS_FULL_SWEEP = "customers_full_sweep"
+KEY_FINGERPRINTS = "fingerprints"
+
+# pages buffered between the fetching and the writing thread in pipelined mode
+DEFAULT_PIPELINE_BUFFER_PAGES = 10
+
+# upper bound of the adaptive rate limiter shared by all requests
+DEFAULT_MAX_REQUESTS_PER_SECOND = 10
+
+# records written without flattening to gzip compressed JSON lines files
+OUTPUT_FORMAT_NDJSON = "ndjson"
+
+# product variations fetched in parallel while the products are written
+DEFAULT_VARIATIONS_CONCURRENCY = 4
+
+# output tables of the deleted records, order_deleted, product_deleted and customer_deleted
+DELETED_TABLES = {"orders": "order", "products": "product", "customers": "customer"}
+
+# requests, timings and table sizes of the run, written to out/files with every run
+RUN_METRICS_FILE = "run_metrics.json"
+
+# recorded to out/files and replayed from in/files by default
+DEFAULT_CASSETTE_NAME = "woocommerce_cassette.jsonl.gz"
+
+# WooCommerce parameter filtering by the last modification date
+MODIFIED_AFTER = "modified_after"
+DEFAULT_MODIFIED_LAG = 5
+
 # #### Keep for debug
 KEY_DEBUG = "debug"
 
@@ -80,19 +155,66 @@ class Component(KBCEnvHandler):
             logging.exception(e)
             exit(1)
 
-        self.client = WooCommerceClient(
-            url=self.cfg_params.get("store_url"),
-            consumer_key=self.cfg_params.get(CONSUMER_KEY),
-            consumer_secret=self.cfg_params.get(CONSUMER_SECRET),
-            version=self.cfg_params.get("version", "wc/v3"),
-            query_string_auth=self.cfg_params.get(KEY_QUERY_STRING_AUTH, False)
-        )
+        additional_options = self.cfg_params.get(KEY_ADDITIONAL_OPTIONS, {})
+        self.concurrency = additional_options.get(KEY_CONCURRENCY, DEFAULT_CONCURRENCY)
+        self.parallel_endpoints = additional_options.get(KEY_PARALLEL_ENDPOINTS, False)
+        self.max_window_records = None
+        if additional_options.get(KEY_DATE_WINDOW_SHARDING, False):
+            self.max_window_records = additional_options.get(KEY_MAX_WINDOW_RECORDS, DEFAULT_MAX_WINDOW_RECORDS)
+        self.resumable = additional_options.get(KEY_RESUMABLE_EXTRACTION, False)
+        max_run_time = additional_options.get(KEY_MAX_RUN_TIME)
+        self.deadline = time.monotonic() + max_run_time if max_run_time else None
+        self.pipeline_buffer_pages = 0
+        if additional_options.get(KEY_PIPELINED_WRITES, False):
+            self.pipeline_buffer_pages = additional_options.get(KEY_PIPELINE_BUFFER_PAGES,
+                                                                DEFAULT_PIPELINE_BUFFER_PAGES)
+        self.fields = {}
+        if additional_options.get(KEY_FIELDS_PROJECTION, False):
+            # the writers need the id of every record
+            custom_fields = {endpoint: ["id"] + [field for field in fields if field != "id"]
+                             for endpoint, fields in additional_options.get(KEY_FIELDS, {}).items() if fields}
+            self.fields = {**DEFAULT_FIELDS, **custom_fields}
+        self.cassette = self.create_cassette(additional_options)
+        self.rate_limiter = None
+        if additional_options.get(KEY_ADAPTIVE_RATE_LIMIT, False):
+            self.rate_limiter = AdaptiveRateLimiter(
+                additional_options.get(KEY_MAX_REQUESTS_PER_SECOND, DEFAULT_MAX_REQUESTS_PER_SECOND))
+        self.adaptive_page_size = additional_options.get(KEY_ADAPTIVE_PAGE_SIZE, False)
+        self.ndjson_output = additional_options.get(KEY_OUTPUT_FORMAT) == OUTPUT_FORMAT_NDJSON
+        self.slice_size_mb = 0
+        if additional_options.get(KEY_SLICED_OUTPUT, False):
+            self.slice_size_mb = additional_options.get(KEY_SLICE_SIZE_MB, DEFAULT_SLICE_SIZE_MB)
+        self.slice_rows = additional_options.get(KEY_SLICE_ROWS)
+        self.detect_deleted = additional_options.get(KEY_DETECT_DELETED, False)
+        self.status_sharding = additional_options.get(KEY_STATUS_SHARDING, False)
+        self.incremental_customers = additional_options.get(KEY_INCREMENTAL_CUSTOMERS, False)
+        self.customers_full_sweep_days = additional_options.get(KEY_CUSTOMERS_FULL_SWEEP_DAYS)
+        # customers of the downloaded orders, the customers downloaded in incremental_customers mode
+        self.order_customer_ids = set()
+        self.skip_unchanged = additional_options.get(KEY_SKIP_UNCHANGED, False) and not self.ndjson_output
+        self.fingerprint_max_records = additional_options.get(KEY_FINGERPRINT_MAX_RECORDS, DEFAULT_MAX_FINGERPRINTS)
+        self.fingerprint_refresh_days = additional_options.get(KEY_FINGERPRINT_REFRESH_DAYS, DEFAULT_REFRESH_DAYS)
+        # endpoint -> FingerprintStore of the customers and products in skip_unchanged_records mode
+        self.fingerprints = {}
+        # ids written in the run, records shifted to a later page while paginating are written once
+        self.written_ids = {endpoint: IdSet() for endpoint in ("orders", "products", "customers")}
+        self.variations_concurrency = 0
+        if additional_options.get(KEY_PRODUCT_VARIATIONS, False) and not self.ndjson_output:
+            self.variations_concurrency = additional_options.get(KEY_VARIATIONS_CONCURRENCY,
+                                                                 DEFAULT_VARIATIONS_CONCURRENCY)
+        # shared by the clients and the writers of all endpoints
+        self.metrics = RunMetrics()
+        self.client = self.create_client()
         self.extraction_time = datetime.datetime.now().isoformat()
-        self.flatten_metadata = self.cfg_params.get(KEY_ADDITIONAL_OPTIONS, {}).get(KEY_FLATTEN_METADATA, False)
+        self.files_out_path = os.path.join(self.data_path, "out", "files")
+        self.modified_cursors = {}
+        # records modified while the run downloads other pages are downloaded again by the next run
+        self.modified_cursor_limit = datetime.datetime.utcnow().replace(microsecond=0).isoformat()
+        self.flatten_metadata = additional_options.get(KEY_FLATTEN_METADATA, False)
         if self.flatten_metadata:
-            logging.warning("The component has been started with flatten metadata param set to true. This legacy "
-                            "option can cause oom error in some cases. Please consider turning this off and processing "
-                            "extracted data using Keboola transformations.")
+            logging.info(f"Flattening metadata values at most {METADATA_MAX_DEPTH} levels deep into at most "
+                         f"{METADATA_MAX_COLUMNS} new columns per table, further keys are stored as JSON in the "
+                         f"{OVERFLOW_COLUMN} column")
 
     def run(self):
         """
@@ -123,109 +245,418 @@ class Component(KBCEnvHandler):
                 raise UserException("Failed to parse custom incremental date") from val_err
             logging.info(
                 f"Getting data From: {custom_incremental_date} Till Now using '{custom_incremental_field}' param")
+        elif fetching_mode == "Incremental Fetching with modified date":
+            custom_incremental_field = MODIFIED_AFTER
+            logging.info("Getting data modified since the last run")
         else:
             logging.info("Getting all data")
-        results = []
+
+        automatic_incremental = fetching_mode == "Incremental Fetching with modified date"
+        previous_cursors = last_state.get(KEY_MODIFIED_CURSORS, {})
+        self.modified_cursors = dict(previous_cursors)
+
+        previous_checkpoints = last_state.get(KEY_CHECKPOINTS, {})
+        fingerprint = config_fingerprint({key: params.get(key) for key in (
+            KEY_FETCHING_MODE, DATE_FROM, DATE_TO, KEY_CUSTOM_INCREMENTAL_FIELD, KEY_CUSTOM_INCREMENTAL_VALUE)})
+        checkpoints = []
+        downloads = []
+        # downloads that need the results of the other downloads
+        dependent_downloads = []
         endpoints = params.get("endpoint", ["Orders", "Products", "Customers"])
+        changed_customers = self.changed_customers_only(endpoints, last_state)
+        previous_fingerprints = last_state.get(KEY_FINGERPRINTS, {})
+        if self.skip_unchanged and not params.get(KEY_INCREMENTAL, True):
+            logging.warning("Unchanged records are written with Full Load, skipping them would remove them")
+        elif self.skip_unchanged:
+            self.fingerprints = {
+                endpoint: FingerprintStore.from_state(endpoint, previous_fingerprints.get(endpoint),
+                                                      self.fingerprint_max_records, self.fingerprint_refresh_days)
+                for endpoint in ("customers", "products") if endpoint in [e.lower() for e in endpoints]
+            }
         for endpoint in endpoints:
+            if endpoint.lower() == "customers" and changed_customers:
+                dependent_downloads.append(("Customers", functools.partial(
+                    self.download_customers, last_state, customer_ids=self.order_customer_ids)))
+                continue
+            endpoint_incremental_date = custom_incremental_date
+            if automatic_incremental and endpoint.lower() in ["orders", "products"]:
+                endpoint_incremental_date = self.get_modified_after(endpoint.lower(), previous_cursors)
+            checkpoint = self.create_checkpoint(endpoint.lower(), previous_checkpoints, fingerprint,
+                                                start_date, end_date, endpoint_incremental_date)
+            if checkpoint:
+                checkpoints.append(checkpoint)
             if endpoint.lower() == "orders":
-                logging.info("Downloading Orders")
-                results.extend(
-                    self.download_orders(
-                        start_date,
-                        end_date,
-                        last_state,
-                        custom_incremental_field,
-                        custom_incremental_date
-                    )
-                )
+                downloads.append(("Orders", functools.partial(
+                    self.download_orders,
+                    start_date,
+                    end_date,
+                    last_state,
+                    custom_incremental_field,
+                    endpoint_incremental_date,
+                    checkpoint=checkpoint,
+                    dates_are_gmt=automatic_incremental
+                )))
             if endpoint.lower() == "products":
-                logging.info("Downloading Products")
-                results.extend(
-                    self.download_products(
-                        start_date,
-                        end_date,
-                        last_state,
-                        custom_incremental_field,
-                        custom_incremental_date
-                    )
-                )
+                downloads.append(("Products", functools.partial(
+                    self.download_products,
+                    start_date,
+                    end_date,
+                    last_state,
+                    custom_incremental_field,
+                    endpoint_incremental_date,
+                    checkpoint=checkpoint,
+                    dates_are_gmt=automatic_incremental
+                )))
             if endpoint.lower() == "customers":
-                logging.info("Downloading Customers")
-                results.extend(self.download_customers(last_state))
+                downloads.append(("Customers", functools.partial(
+                    self.download_customers, last_state, checkpoint=checkpoint)))
+
+        results = []
+        try:
+            for endpoint_results in self.run_downloads(downloads) + self.run_downloads(dependent_downloads):
+                results.extend(endpoint_results)
+        finally:
+            if self.cassette:
+                self.cassette.close()
+
+        record_ids = {}
+        if self.detect_deleted:
+            previous_ids = last_state.get(KEY_RECORD_IDS, {})
+            for endpoint in endpoints:
+                deleted_results, record_ids[endpoint.lower()] = self.detect_deleted_records(
+                    endpoint.lower(), previous_ids, last_state)
+                results.extend(deleted_results)
+
+        table_rows = {os.path.basename(r.full_path): r.rows for r in results}
+        if self.slice_size_mb:
+            self.slice_results(results)
 
         # get current columns and store in state
-        headers = {}
+        state = {}
         for r in results:
             file_name = os.path.basename(r.full_path)
-            headers[file_name] = r.table_def.columns
-        self.write_state_file(headers)
+            state[file_name] = r.table_def.columns
+        if automatic_incremental:
+            for checkpoint in checkpoints:
+                # records modified before the cursor may be still missing in an unfinished download
+                if checkpoint.finished:
+                    continue
+                if checkpoint.endpoint in previous_cursors:
+                    self.modified_cursors[checkpoint.endpoint] = previous_cursors[checkpoint.endpoint]
+                else:
+                    self.modified_cursors.pop(checkpoint.endpoint, None)
+            state[KEY_MODIFIED_CURSORS] = self.modified_cursors
+        if record_ids:
+            state[KEY_RECORD_IDS] = record_ids
+        if self.fingerprints:
+            state[KEY_FINGERPRINTS] = {
+                **previous_fingerprints,
+                **{endpoint: store.to_state() for endpoint, store in self.fingerprints.items()}
+            }
+        if self.incremental_customers:
+            state[KEY_CUSTOMERS_FULL_SWEEP] = last_state.get(KEY_CUSTOMERS_FULL_SWEEP)
+            customers_checkpoint = next(
+                (checkpoint for checkpoint in checkpoints if checkpoint.endpoint == "customers"), None)
+            swept = any(endpoint.lower() == "customers" for endpoint in endpoints) and not changed_customers
+            if swept and (not customers_checkpoint or customers_checkpoint.finished):
+                state[KEY_CUSTOMERS_FULL_SWEEP] = self.extraction_time
+        if self.resumable:
+            state[KEY_CHECKPOINTS] = {
+                **previous_checkpoints,
+                **{checkpoint.endpoint: checkpoint.to_state() for checkpoint in checkpoints}
+            }
+        self.write_state_file(state)
+
+        incremental = params.get(KEY_INCREMENTAL, True)
+        if not incremental and any(checkpoint.resumed or not checkpoint.finished for checkpoint in checkpoints):
+            logging.warning("Part of the data is downloaded in another run, the tables are loaded incrementally "
+                            "so that the data is not overwritten")
+            incremental = True
+        # sliced tables have no header, the columns are in the manifest
+        self.create_manifests(results, headless=bool(self.slice_size_mb), incremental=incremental)
+        os.makedirs(self.files_out_path, exist_ok=True)
+        self.metrics.write_report(os.path.join(self.files_out_path, RUN_METRICS_FILE), table_rows)
+
+    def slice_results(self, results):
+        """
+        Split the output tables into folders of gzip compressed slices, which Storage uploads and loads in parallel
+        """
+        max_bytes = int(self.slice_size_mb * 1024 * 1024)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            headers = executor.map(lambda result: slice_table(result.full_path, max_bytes, self.slice_rows), results)
+            for result, header in zip(results, headers):
+                result.table_def.columns = header
+
+    def detect_deleted_records(self, endpoint, previous_ids, file_headers):
+        """
+        Lists the ids of all records of the endpoint and writes the ids known from the previous run that are gone to
+        the deleted table, e.g. order_deleted. Returns the results and the encoded ids for the state.
+        """
+        ids = self.client.get_record_ids(endpoint)
+        if endpoint not in previous_ids:
+            logging.info(f"Found {len(ids)} {endpoint}, deleted {endpoint} are detected from the next run")
+            return [], encode_ids(ids)
+        missing = decode_ids(previous_ids[endpoint]) - ids
+        # records created or deleted during the scan shift the pages, skipped records are not deleted
+        ids |= self.client.get_existing_ids(endpoint, missing)
+        deleted = missing - ids
+        logging.info(f"Found {len(ids)} {endpoint}, {len(deleted)} deleted since the previous run")
+        writer = DeletedRecordsWriter(self.tables_out_path, DELETED_TABLES[endpoint], self.extraction_time,
+                                      file_headers=file_headers)
+        with writer:
+            writer.write_ids(deleted)
+        return writer.collect_results(), encode_ids(ids)
+
+    def changed_customers_only(self, endpoints, last_state):
+        """
+        In incremental_customers mode only the customers of the downloaded orders are downloaded, except for the
+        first run and the periodic full sweeps of all customers
+        """
+        if not self.incremental_customers:
+            return False
+        if "orders" not in [endpoint.lower() for endpoint in endpoints]:
+            logging.warning("Incremental customers need the Orders endpoint, downloading all customers")
+            return False
+        last_sweep = last_state.get(KEY_CUSTOMERS_FULL_SWEEP)
+        if not last_sweep:
+            logging.info("Downloading all customers, the next runs download the customers of the new orders")
+            return False
+        if self.customers_full_sweep_days and datetime.datetime.fromisoformat(last_sweep) <= \
+                datetime.datetime.now() - datetime.timedelta(days=self.customers_full_sweep_days):
+            logging.info(f"Downloading all customers, the last full download was on {last_sweep}")
+            return False
+        return True
+
+    def get_modified_after(self, endpoint, cursors):
+        """
+        Returns the modified_after value continuing from the last modification date seen by the previous run,
+        None if there is no previous run and all data is downloaded
+        """
+        cursor = cursors.get(endpoint)
+        if not cursor:
+            logging.info(f"No previous modification date of {endpoint} found, getting all data")
+            return None
+        lag = datetime.timedelta(minutes=self.cfg_params.get(KEY_MODIFIED_LAG, DEFAULT_MODIFIED_LAG))
+        modified_after = (datetime.datetime.fromisoformat(cursor) - lag).isoformat()
+        logging.info(f"Getting {endpoint} modified after {modified_after} GMT")
+        return modified_after
+
+    def track_modified_cursor(self, endpoint, record):
+        """
+        The cursor is the latest modification date seen, but at most the start of the run. A record modified after
+        its page was fetched is then still modified after the cursor of the next run.
+        """
+        modified = record.get("date_modified_gmt")
+        if modified:
+            modified = min(modified, self.modified_cursor_limit)
+        if modified and modified > self.modified_cursors.get(endpoint, ""):
+            self.modified_cursors[endpoint] = modified
+
+    def create_checkpoint(self, endpoint, previous_checkpoints, fingerprint, start_date, end_date,
+                          custom_incremental_date):
+        if not self.resumable:
+            return None
+        return ExtractionCheckpoint(
+            endpoint,
+            fingerprint,
+            previous=previous_checkpoints.get(endpoint),
+            deadline=self.deadline,
+            date_from=start_date,
+            date_to=end_date,
+            custom_incremental_date=custom_incremental_date
+        )
+
+    def create_cassette(self, additional_options):
+        mode = additional_options.get(KEY_CASSETTE_MODE)
+        if not mode:
+            return None
+        folder = os.path.join("out", "files") if mode == RECORD else os.path.join("in", "files")
+        path = additional_options.get(KEY_CASSETTE_PATH) or os.path.join(folder, DEFAULT_CASSETTE_NAME)
+        try:
+            return Cassette(os.path.join(self.data_path, path), mode)
+        except CassetteError as err:
+            raise UserException(str(err)) from err
+
+    def create_client(self, authenticate=True):
+        return WooCommerceClient(
+            url=self.cfg_params.get("store_url"),
+            consumer_key=self.cfg_params.get(CONSUMER_KEY),
+            consumer_secret=self.cfg_params.get(CONSUMER_SECRET),
+            version=self.cfg_params.get("version", "wc/v3"),
+            authenticate=authenticate,
+            query_string_auth=self.cfg_params.get(KEY_QUERY_STRING_AUTH, False),
+            concurrency=self.concurrency,
+            max_window_records=self.max_window_records,
+            fields=self.fields,
+            cassette=self.cassette,
+            rate_limiter=self.rate_limiter,
+            adaptive_page_size=self.adaptive_page_size,
+            # the variation workers share the connections of the products download
+            pool_size=self.variations_concurrency,
+            metrics=self.metrics,
+            status_sharding=self.status_sharding
+        )
+
+    def run_downloads(self, downloads):
+        """
+        Run the endpoint downloads and return their results in the configured endpoint order.
+        In parallel_endpoints mode each download runs in its own thread with its own client.
+        """
+        if not self.parallel_endpoints or len(downloads) < 2:
+            results = []
+            for name, download in downloads:
+                logging.info(f"Downloading {name}")
+                results.append(download(client=self.client))
+            return results
 
-        self.create_manifests(results, incremental=params.get(KEY_INCREMENTAL, True))
+        logging.info(f"Downloading {', '.join(name for name, _ in downloads)} in parallel")
+        clients = [self.create_client(authenticate=False) for _ in downloads]
+        try:
+            with ThreadPoolExecutor(max_workers=len(downloads)) as executor:
+                futures = [executor.submit(download, client=client)
+                           for (_, download), client in zip(downloads, clients)]
+                return [future.result() for future in futures]
+        finally:
+            for client in clients:
+                client.close()
+
+    def pipelined(self, pages):
+        """
+        In pipelined mode the pages are fetched by a background thread while the current thread writes them,
+        so that the flattening overlaps with the network latency
+        """
+        if not self.pipeline_buffer_pages:
+            return pages
+        return prefetch(pages, self.pipeline_buffer_pages)
 
-    @error_handling
     def download_orders(self, start_date, end_date, file_headers, custom_incremental_field,
-                        custom_incremental_date):
-        with OrdersWriter(
+                        custom_incremental_date, client=None, checkpoint=None, dates_are_gmt=False):
+        client = client or self.client
+        if checkpoint:
+            start_date, end_date = checkpoint.date_from, checkpoint.date_to
+            custom_incremental_date = checkpoint.custom_incremental_date
+        if self.ndjson_output:
+            writer = NdjsonWriter(self.files_out_path, "order")
+        else:
+            writer = OrdersWriter(
                 self.tables_out_path,
                 "order",
                 extraction_time=self.extraction_time,
                 file_headers=file_headers,
                 flatten_metadata=self.flatten_metadata
-        ) as writer:
-            for data in self.client.get_orders(date_from=start_date, date_to=end_date,
-                                               custom_incremental_field=custom_incremental_field,
-                                               custom_incremental_date=custom_incremental_date):
+            )
+        with writer:
+            for data in self.pipelined(client.get_orders(date_from=start_date, date_to=end_date,
+                                                         custom_incremental_field=custom_incremental_field,
+                                                         custom_incremental_date=custom_incremental_date,
+                                                         checkpoint=checkpoint, dates_are_gmt=dates_are_gmt)):
                 try:
-                    for obj in data:
-                        writer.write(obj)
+                    data = self.drop_repeated("orders", data)
+                    self.metrics.add("orders", records=len(data))
+                    with self.metrics.timer("orders", "write"):
+                        for obj in release_records(data):
+                            self.track_modified_cursor("orders", obj)
+                            # guest orders have customer_id 0
+                            if obj.get("customer_id"):
+                                self.order_customer_ids.add(obj["customer_id"])
+                            writer.write(obj)
                 except Exception as err:
                     logging.error(f"Fail to download orders: {err}")
+        self.report_download("orders")
         results = writer.collect_results()
         return results
 
-    @error_handling
-    def download_customers(self, file_headers):
-        with CustomersWriter(
+    def download_customers(self, file_headers, client=None, checkpoint=None, customer_ids=None):
+        client = client or self.client
+        if customer_ids is not None:
+            logging.info(f"Downloading {len(customer_ids)} customers of the downloaded orders")
+            pages = client.get_customers_by_ids(customer_ids)
+        else:
+            pages = client.get_customers(checkpoint=checkpoint)
+        if self.ndjson_output:
+            writer = NdjsonWriter(self.files_out_path, "customer")
+        else:
+            writer = CustomersWriter(
                 self.tables_out_path,
                 "customer",
                 extraction_time=self.extraction_time,
                 file_headers=file_headers,
-                flatten_metadata=self.flatten_metadata
-        ) as writer:
-            for data in self.client.get_customers():
+                flatten_metadata=self.flatten_metadata,
+                fingerprints=self.fingerprints.get("customers")
+            )
+        with writer:
+            for data in self.pipelined(pages):
                 try:
-                    for customer in data:
-                        writer.write(customer)
+                    data = self.drop_repeated("customers", data)
+                    self.metrics.add("customers", records=len(data))
+                    with self.metrics.timer("customers", "write"):
+                        for customer in release_records(data):
+                            writer.write(customer)
                 except Exception as err:
                     logging.error(f"Fail to fetch customers {err}")
+        self.report_download("customers")
         results = writer.collect_results()
         return results
 
-    @error_handling
     def download_products(self, start_date, end_date, file_headers, custom_incremental_field,
-                          custom_incremental_date):
-        with ProductsWriter(
+                          custom_incremental_date, client=None, checkpoint=None, dates_are_gmt=False):
+        client = client or self.client
+        if checkpoint:
+            start_date, end_date = checkpoint.date_from, checkpoint.date_to
+            custom_incremental_date = checkpoint.custom_incremental_date
+        if self.ndjson_output:
+            writer = NdjsonWriter(self.files_out_path, "product")
+        else:
+            writer = ProductsWriter(
                 self.tables_out_path,
                 "product",
                 prefix="product__",
                 extraction_time=self.extraction_time,
                 file_headers=file_headers,
-                client=self.client,
-                flatten_metadata=self.flatten_metadata
-        ) as writer:
-            for data in self.client.get_products(
+                client=client,
+                flatten_metadata=self.flatten_metadata,
+                variations_concurrency=self.variations_concurrency,
+                fingerprints=self.fingerprints.get("products")
+            )
+        with writer:
+            for data in self.pipelined(client.get_products(
                     date_from=start_date, date_to=end_date, custom_incremental_field=custom_incremental_field,
-                    custom_incremental_date=custom_incremental_date
-            ):
+                    custom_incremental_date=custom_incremental_date, checkpoint=checkpoint, dates_are_gmt=dates_are_gmt
+            )):
                 try:
-                    for product in data:
-                        writer.write(product)
+                    data = self.drop_repeated("products", data)
+                    self.metrics.add("products", records=len(data))
+                    with self.metrics.timer("products", "write"):
+                        for product in release_records(data):
+                            self.track_modified_cursor("products", product)
+                            writer.write(product)
                 except Exception as err:
                     logging.error(f"Fail to fetch  products {err}")
+        self.report_download("products")
         results = writer.collect_results()
         return results
 
+    def drop_repeated(self, endpoint, page):
+        """
+        Records created or deleted during the download shift the following records between pages, a record may then
+        appear on two pages while another one is missed. Repeated records are not written again.
+        """
+        written_ids = self.written_ids[endpoint]
+        records = [record for record in page if not written_ids.add(record.get("id"))]
+        if len(records) < len(page):
+            self.metrics.add(endpoint, drifted=len(page) - len(records))
+        return records
+
+    def report_download(self, endpoint):
+        drifted = self.metrics.get(endpoint, "drifted")
+        if drifted:
+            logging.warning(f"{drifted} {endpoint} shifted between pages during the download and were received "
+                            f"twice, up to the same number of {endpoint} may be missing until the next run")
+        store = self.fingerprints.get(endpoint)
+        if store:
+            logging.info(f"Skipped {store.skipped} unchanged {endpoint}")
+            self.metrics.add(endpoint, unchanged_skipped=store.skipped)
+
 
 """
         Main entrypoint
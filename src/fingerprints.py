@@ -0,0 +1,113 @@
+import array
+import base64
+import bisect
+import datetime
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import sys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from record_ids import decode_sorted_ids, encode_ids
+
+# 4 byte hashes keep the state of a million records at about 6 MB
+HASH_SIZE = 4
+DEFAULT_MAX_FINGERPRINTS = 1000000
+# all records are written again after this many days, which also repairs the rare hash collisions
+DEFAULT_REFRESH_DAYS = 7
+
+
+def record_hash(record: dict) -> int:
+    content = None
+    if orjson:
+        try:
+            content = orjson.dumps(record, option=orjson.OPT_SORT_KEYS)
+        except orjson.JSONEncodeError:
+            # e.g. integers over 64 bits
+            pass
+    if content is None:
+        content = json.dumps(record, sort_keys=True).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(content, digest_size=HASH_SIZE).digest(), "little")
+
+
+class FingerprintStore:
+    """
+    Content hashes of the records of an endpoint written by the previous successful runs, keyed by the record id.
+    Records with an unchanged hash are not written again. The hashes of the previous runs are held in sorted arrays,
+    about 12 bytes per record, only the new and changed hashes of the run are held in a dict. The store holds at
+    most max_records records, the ones with the lowest ids, and is dropped every refresh_days days so that all
+    records are written again.
+    """
+
+    def __init__(self, endpoint: str, ids: array.array = None, hashes: array.array = None, created: str = None,
+                 max_records: int = DEFAULT_MAX_FINGERPRINTS):
+        self.endpoint = endpoint
+        # sorted ids and their hashes of the previous runs
+        self.ids = ids if ids is not None else array.array("Q")
+        self.hashes = hashes if hashes is not None else array.array("I")
+        # id -> hash of the records written in the run
+        self.updates = {}
+        self.created = created or datetime.datetime.now().isoformat()
+        self.max_records = max_records
+        self.skipped = 0
+
+    @classmethod
+    def from_state(cls, endpoint: str, state: dict = None, max_records: int = DEFAULT_MAX_FINGERPRINTS,
+                   refresh_days: int = DEFAULT_REFRESH_DAYS):
+        if not state:
+            return cls(endpoint, max_records=max_records)
+        created = datetime.datetime.fromisoformat(state["created"])
+        if created <= datetime.datetime.now() - datetime.timedelta(days=refresh_days):
+            logging.info(f"Writing all {endpoint}, the unchanged {endpoint} are skipped again from the next run")
+            return cls(endpoint, max_records=max_records)
+        hashes = array.array("I")
+        hashes.frombytes(base64.b64decode(state["hashes"]))
+        if sys.byteorder != "little":
+            hashes.byteswap()
+        return cls(endpoint, decode_sorted_ids(state["ids"]), hashes, state["created"], max_records)
+
+    def previous_hash(self, record_id):
+        index = bisect.bisect_left(self.ids, record_id)
+        if index < len(self.ids) and self.ids[index] == record_id:
+            return self.hashes[index]
+        return None
+
+    def unchanged(self, record_id, fingerprint: int) -> bool:
+        """
+        Whether the record is the same as in the previous runs
+        """
+        if isinstance(record_id, int) and self.previous_hash(record_id) == fingerprint:
+            self.skipped += 1
+            return True
+        return False
+
+    def update(self, record_id, fingerprint: int):
+        """
+        Stores the hash of a written record for the next run
+        """
+        if isinstance(record_id, int):
+            self.updates[record_id] = fingerprint
+
+    def to_state(self) -> dict:
+        # the hashes of the run replace the previous ones of the same records
+        previous = ((record_id, fingerprint) for record_id, fingerprint in zip(self.ids, self.hashes)
+                    if record_id not in self.updates)
+        ids = array.array("Q")
+        hashes = array.array("I")
+        for record_id, fingerprint in itertools.islice(heapq.merge(previous, sorted(self.updates.items())),
+                                                       self.max_records):
+            ids.append(record_id)
+            hashes.append(fingerprint)
+        if sys.byteorder != "little":
+            hashes.byteswap()
+        return {
+            "created": self.created,
+            "ids": encode_ids(ids),
+            "hashes": base64.b64encode(hashes.tobytes()).decode("ascii")
+        }
@@ -0,0 +1,82 @@
+import collections
+import contextlib
+import json
+import logging
+import re
+import resource
+import threading
+import time
+
+
+def metrics_endpoint(endpoint: str) -> str:
+    """
+    Endpoint the metrics of a request are counted to, e.g. products/variations for products/15/variations
+    """
+    return re.sub(r"/\d+", "", endpoint)
+
+
+class RunMetrics:
+    """
+    Counters and timings of a run per endpoint, shared by all clients and writers of the run. Times are summed over
+    all threads, so with concurrent downloads they may exceed the duration of the run.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.endpoints = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+
+    def add(self, endpoint: str, **values):
+        with self._lock:
+            self.endpoints[endpoint].update(values)
+
+    def get(self, endpoint: str, key: str):
+        with self._lock:
+            return self.endpoints.get(endpoint, {}).get(key, 0)
+
+    @contextlib.contextmanager
+    def timer(self, endpoint: str, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(endpoint, **{f"{stage}_seconds": time.perf_counter() - start})
+
+    @staticmethod
+    def peak_rss_mb() -> float:
+        # kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def report(self, table_rows: dict = None) -> dict:
+        with self._lock:
+            endpoints = {
+                endpoint: {key: round(value, 3) if isinstance(value, float) else value
+                           for key, value in sorted(counters.items())}
+                for endpoint, counters in sorted(self.endpoints.items())
+            }
+        return {
+            "duration_seconds": round(time.monotonic() - self.started, 3),
+            "peak_rss_mb": round(self.peak_rss_mb(), 1),
+            "endpoints": endpoints,
+            "table_rows": table_rows or {}
+        }
+
+    def summary(self) -> str:
+        report = self.report()
+        parts = []
+        for endpoint, counters in report["endpoints"].items():
+            parts.append(
+                f"{endpoint}: {counters.get('records', 0)} records, {counters.get('requests', 0)} requests, "
+                f"{counters.get('retries', 0)} retries, {counters.get('throttled', 0)} throttled, "
+                f"{counters.get('bytes', 0) / 1e6:.1f} MB, http {counters.get('http_seconds', 0):.1f} s, "
+                f"decode {counters.get('decode_seconds', 0):.1f} s, write {counters.get('write_seconds', 0):.1f} s"
+            )
+        return f"Run finished in {report['duration_seconds']:.1f} s, peak RSS {report['peak_rss_mb']:.0f} MB. " \
+               + "; ".join(parts)
+
+    def write_report(self, path: str, table_rows: dict = None):
+        with open(path, "w") as report_file:
+            json.dump(self.report(table_rows), report_file, indent=2)
+        with open(f"{path}.manifest", "w") as manifest:
+            json.dump({"tags": ["woocommerce", "run_metrics"], "is_permanent": False, "is_public": False}, manifest)
+        logging.info(self.summary())
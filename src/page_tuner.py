@@ -0,0 +1,80 @@
+import collections
+import logging
+import math
+import threading
+
+# WooCommerce rejects larger pages unless the store raises the limit with a filter
+DEFAULT_MAX_PAGE_SIZE = 100
+# probed once per endpoint, stores rarely allow more
+PROBED_MAX_PAGE_SIZE = 500
+MIN_PAGE_SIZE = 10
+
+# pages faster than this grow, pages slower than SLOW_FRACTION of the timeout shrink
+FAST_LATENCY = 2.0
+SLOW_FRACTION = 0.5
+
+# the timeout is TIMEOUT_FACTOR times the p95 latency of a page of the current size
+TIMEOUT_FACTOR = 4
+MIN_TIMEOUT = 10.0
+MAX_TIMEOUT = 120.0
+LATENCY_SAMPLES = 50
+MIN_LATENCY_SAMPLES = 5
+
+
+class PageSizeTuner:
+    """
+    Page size and request timeout of a single endpoint adapted to the store. The page size doubles while pages are
+    fast, up to the probed maximum, and halves when a page gets close to the timeout or fails. A failed page also
+    lowers the maximum to half of its size. The timeout is derived from the p95 latency per record of the recent
+    pages.
+    """
+
+    def __init__(self, endpoint: str, per_page: int, max_page_size: int = DEFAULT_MAX_PAGE_SIZE):
+        self.endpoint = endpoint
+        self.max_page_size = max(MIN_PAGE_SIZE, max_page_size)
+        self.per_page = min(max(MIN_PAGE_SIZE, per_page), self.max_page_size)
+        self._record_latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self) -> float:
+        with self._lock:
+            if len(self._record_latencies) < MIN_LATENCY_SAMPLES:
+                return MAX_TIMEOUT
+            latencies = sorted(self._record_latencies)
+            p95 = latencies[min(len(latencies) - 1, math.ceil(0.95 * len(latencies)) - 1)]
+            return min(MAX_TIMEOUT, max(MIN_TIMEOUT, TIMEOUT_FACTOR * p95 * self.per_page))
+
+    def observe(self, size: int, latency: float):
+        timeout = self.timeout
+        with self._lock:
+            self._record_latencies.append(latency / max(1, size))
+            if size < self.per_page:
+                # a remainder or a split page says nothing about the current size
+                return
+            if latency > SLOW_FRACTION * timeout:
+                self._resize(self.per_page // 2, f"page took {latency:.1f} s")
+            elif latency < FAST_LATENCY:
+                self._resize(self.per_page * 2, f"page took {latency:.1f} s")
+
+    def shrink(self, failed_size: int, reason: str):
+        """
+        Halves the page size after a failed page, pages of the failed size are not tried again
+        """
+        with self._lock:
+            self.max_page_size = max(MIN_PAGE_SIZE, min(self.max_page_size, failed_size // 2))
+            self._resize(self.per_page // 2, reason)
+
+    def limit(self, max_page_size: int, reason: str):
+        """
+        Lowers the maximum to the page size the store actually returns
+        """
+        with self._lock:
+            self.max_page_size = max(MIN_PAGE_SIZE, min(self.max_page_size, max_page_size))
+            self._resize(self.per_page, reason)
+
+    def _resize(self, per_page, reason):
+        per_page = min(max(MIN_PAGE_SIZE, per_page), self.max_page_size)
+        if per_page != self.per_page:
+            logging.info(f"Changing {self.endpoint} page size from {self.per_page} to {per_page}, {reason}")
+            self.per_page = per_page
@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+
+# requests per second never go below one request in five seconds
+MIN_RATE = 0.2
+# tokens saved while idle, keeps the requests evenly spaced
+BURST = 2.0
+# the rate grows by about one request per second every second while the store is healthy
+ADDITIVE_INCREASE = 1.0
+# cut of the rate on 429 and 503 responses and timeouts
+THROTTLE_DECREASE = 0.5
+# cut of the rate when the recent latency grows over LATENCY_TOLERANCE times the long term latency
+LATENCY_DECREASE = 0.8
+LATENCY_TOLERANCE = 2.0
+# smoothing of the recent and the long term latency averages
+FAST_ALPHA = 0.2
+SLOW_ALPHA = 0.02
+# concurrent failures of one overload are counted as a single decrease
+DECREASE_COOLDOWN = 1.0
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by all requests to the store. The rate is adjusted AIMD style: it grows additively while
+    the store responds without errors and with a stable latency, and it is cut multiplicatively on 429 and 503
+    responses, timeouts and growing latency. A Retry-After header pauses all requests for the requested time.
+    """
+
+    def __init__(self, max_rate: float, initial_rate: float = None):
+        self.max_rate = max(MIN_RATE, max_rate)
+        self.rate = min(self.max_rate, initial_rate or self.max_rate / 2)
+        self.rate = max(MIN_RATE, self.rate)
+        self.tokens = 1.0
+        self.paused_until = 0.0
+        self.fast_latency = None
+        self.slow_latency = None
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if now < self.paused_until:
+            self.tokens = 0.0
+        else:
+            self.tokens = min(BURST, self.tokens + (now - max(self._last_refill, self.paused_until)) * self.rate)
+        self._last_refill = now
+
+    def acquire(self):
+        """
+        Blocks until the request may be sent
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_response(self, status_code: int, latency: float, retry_after: float = None):
+        with self._lock:
+            now = time.monotonic()
+            if status_code in (429, 503):
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+                self._decrease(now, THROTTLE_DECREASE, f"received {status_code}")
+                return
+            if status_code >= 500:
+                # other server errors are retried without changing the rate
+                return
+            self._track_latency(latency)
+            if self.fast_latency > LATENCY_TOLERANCE * self.slow_latency:
+                self._decrease(now, LATENCY_DECREASE, f"latency grew to {self.fast_latency:.2f} s")
+            else:
+                self.rate = min(self.max_rate, self.rate + ADDITIVE_INCREASE / self.rate)
+
+    def on_timeout(self):
+        with self._lock:
+            self._decrease(time.monotonic(), THROTTLE_DECREASE, "request timed out")
+
+    def _track_latency(self, latency):
+        if self.fast_latency is None:
+            self.fast_latency = self.slow_latency = latency
+            return
+        self.fast_latency += FAST_ALPHA * (latency - self.fast_latency)
+        self.slow_latency += SLOW_ALPHA * (latency - self.slow_latency)
+
+    def _decrease(self, now, factor, reason):
+        if now - self._last_decrease < DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self.rate = max(MIN_RATE, self.rate * factor)
+        logging.info(f"Store overloaded ({reason}), slowing down to {self.rate:.1f} requests per second")
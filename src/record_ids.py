@@ -0,0 +1,63 @@
+import array
+import base64
+import itertools
+import sys
+import zlib
+
+# ids of the bitmap of IdSet, the bitmap takes at most 16 MB
+MAX_BITMAP_ID = 2 ** 27
+
+
+def encode_ids(ids) -> str:
+    """
+    Compact text form of a set of record ids for the state file. The sorted ids are stored as differences, which are
+    mostly small for sequential ids and compress to a few bytes per thousand records.
+    """
+    deltas = array.array("Q")
+    previous = 0
+    for record_id in sorted(ids):
+        deltas.append(record_id - previous)
+        previous = record_id
+    if sys.byteorder != "little":
+        deltas.byteswap()
+    return base64.b64encode(zlib.compress(deltas.tobytes(), 9)).decode("ascii")
+
+
+def decode_sorted_ids(encoded: str) -> array.array:
+    deltas = array.array("Q")
+    deltas.frombytes(zlib.decompress(base64.b64decode(encoded)))
+    if sys.byteorder != "little":
+        deltas.byteswap()
+    return array.array("Q", itertools.accumulate(deltas))
+
+
+def decode_ids(encoded: str) -> set:
+    return set(decode_sorted_ids(encoded))
+
+
+class IdSet:
+    """
+    Set of record ids held in a bitmap of a bit per id up to the highest id, 1 MB for 8 million ids. Ids over
+    MAX_BITMAP_ID and ids that are not integers are kept in a set.
+    """
+
+    def __init__(self):
+        self.bitmap = bytearray()
+        self.others = set()
+
+    def add(self, record_id) -> bool:
+        """
+        Adds the id, returns whether the id was already present
+        """
+        if not isinstance(record_id, int) or not 0 <= record_id < MAX_BITMAP_ID:
+            present = record_id in self.others
+            self.others.add(record_id)
+            return present
+        index, bit = divmod(record_id, 8)
+        if index >= len(self.bitmap):
+            self.bitmap.extend(bytes(max(index + 1 - len(self.bitmap), len(self.bitmap))))
+        mask = 1 << bit
+        if self.bitmap[index] & mask:
+            return True
+        self.bitmap[index] |= mask
+        return False
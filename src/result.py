@@ -1,12 +1,158 @@
+import collections
+import gzip
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 from kbc.result import ResultWriter, KBCTableDef
 
+from fingerprints import record_hash
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 EXTRACTION_TIME = "extraction_time"
 KEY_ROW_NR = "row_nr"  # take row number
+# flattening of meta_data values, keys over the column limit are stored as JSON in the overflow column
+METADATA_MAX_DEPTH = 3
+METADATA_MAX_COLUMNS = 200
+OVERFLOW_COLUMN = "overflow"
+# raw output favours the speed of the extraction over the file size
+NDJSON_COMPRESS_LEVEL = 1
+
+
+class NdjsonWriter:
+    """
+    Writes the records as they come from the API, one JSON object per line, into a gzip compressed file in out/files
+    with a file manifest. Used instead of the flattening writers when the data is flattened downstream.
+    """
+
+    def __init__(self, result_dir_path, result_name, tags: List[str] = None):
+        self.full_path = os.path.join(result_dir_path, f"{result_name}.ndjson.gz")
+        self.tags = ["woocommerce", result_name] + (tags or [])
+        self.records = 0
+        self._file = gzip.open(self.full_path, "wb", compresslevel=NDJSON_COMPRESS_LEVEL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def _encode(data):
+        if orjson is not None:
+            try:
+                return orjson.dumps(data)
+            except orjson.JSONEncodeError:
+                # e.g. integers over 64 bits
+                pass
+        return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+    def write(self, data, **kwargs):
+        self._file.write(self._encode(data) + b"\n")
+        self.records += 1
+
+    def write_all(self, data_array, **kwargs):
+        for data in data_array:
+            self.write(data)
+
+    def collect_results(self):
+        # the file is not a table, it is uploaded with its file manifest
+        return []
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        with open(f"{self.full_path}.manifest", "w") as manifest:
+            json.dump({"tags": self.tags, "is_permanent": False, "is_public": False}, manifest)
+        logging.info(f"Written {self.records} records to {os.path.basename(self.full_path)}")
+
+
+class BoundedFlattener:
+    """
+    Flattens nested objects into columns named by the keys joined with the separator, like the flattening of
+    ResultWriter, but at most max_depth levels deep and into at most max_columns columns per table, counting the
+    columns of the previous runs. Deeper objects and lists are stored as JSON, values of keys over the column limit
+    are stored together as a JSON object in the overflow column.
+    """
+
+    def __init__(self, max_depth=METADATA_MAX_DEPTH, max_columns=METADATA_MAX_COLUMNS, separator="__",
+                 known_columns=None):
+        self.max_depth = max_depth
+        self.max_columns = max_columns
+        self.separator = separator
+        # columns of the previous runs are kept and count toward the limit
+        self.known_columns = set(known_columns or [])
+        self.new_columns = set()
+
+    def _allow(self, column):
+        if column in self.known_columns or column in self.new_columns:
+            return True
+        if len(self.known_columns | self.new_columns) < self.max_columns:
+            self.new_columns.add(column)
+            return True
+        return False
+
+    def _flatten(self, prefix, value, depth, row, overflow):
+        if isinstance(value, dict) and value and depth < self.max_depth:
+            for key, child in value.items():
+                self._flatten(f"{prefix}{self.separator}{key}", child, depth + 1, row, overflow)
+            return
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value, ensure_ascii=False)
+        if self._allow(prefix):
+            row[prefix] = value
+        else:
+            overflow[prefix] = value
+
+    def flatten(self, data: dict) -> dict:
+        row = {}
+        overflow = {}
+        for key, value in data.items():
+            self._flatten(key, value, 1, row, overflow)
+        if overflow:
+            row[OVERFLOW_COLUMN] = json.dumps(overflow, ensure_ascii=False)
+        return row
+
+
+class CountingResultWriter(ResultWriter):
+    """
+    ResultWriter counting the rows it writes, the count is set as rows on its results, so that the tables need not
+    be read again for the run metrics
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rows = 0
 
+    def write(
+            self,
+            data,
+            file_name=None,
+            user_values=None,
+            object_from_arrays=False,
+            write_header=True,
+    ):
+        # empty records are not written
+        if data:
+            self.rows += 1
+        super().write(data, file_name, user_values, object_from_arrays, write_header)
+
+    def collect_results(self):
+        results = super().collect_results()
+        for result in results:
+            result.rows = self.rows
+        return results
 
-class MetadataWriter(ResultWriter):
+
+class MetadataWriter(CountingResultWriter):
     def __init__(
             self,
             result_dir_path,
@@ -14,29 +160,45 @@ class MetadataWriter(ResultWriter):
             additional_pk: List[str] = None,
             prefix="",
             file_headers=None,
-            flatten_metadata=True
+            flatten_metadata=True,
+            name="metadata"
     ) -> None:
         pk = ["id"]
         if additional_pk:
             pk.extend(additional_pk)
-        result_name = f"{prefix}metadata"
+        result_name = f"{prefix}{name}"
+        columns = file_headers.get(f"{result_name}.csv", [])
         super().__init__(
             result_dir_path,
             KBCTableDef(
                 name=result_name,
                 pk=pk,
-                columns=file_headers.get(f"{prefix}metadata.csv", []),
+                columns=columns,
                 destination="",
             ),
             fix_headers=True,
-            flatten_objects=flatten_metadata,
+            flatten_objects=False,
             child_separator="__",
         )
         self.extration_time = extraction_time
         self.result_dir_path = result_dir_path
+        # plugins store large nested blobs in meta_data, their flattening is bounded to keep the columns in check
+        self.flattener = BoundedFlattener(known_columns=columns) if flatten_metadata else None
+
+    def write(
+            self,
+            data,
+            file_name=None,
+            user_values=None,
+            object_from_arrays=False,
+            write_header=True,
+    ):
+        if self.flattener:
+            data = self.flattener.flatten(data)
+        super().write(data, file_name, user_values, object_from_arrays, write_header)
 
 
-class FeeLinesWriter(ResultWriter):
+class FeeLinesWriter(CountingResultWriter):
     def __init__(
             self,
             result_dir_path,
@@ -65,7 +227,33 @@ class FeeLinesWriter(ResultWriter):
         self.result_dir_path = result_dir_path
 
 
-class RefundsWriter(ResultWriter):
+class DeletedRecordsWriter(CountingResultWriter):
+    """
+    Ids of the records deleted since the previous run, e.g. order_deleted for orders
+    """
+
+    def __init__(self, result_dir_path, result_name, extraction_time, file_headers=None):
+        result_name = f"{result_name}_deleted"
+        super().__init__(
+            result_dir_path,
+            KBCTableDef(
+                name=result_name,
+                pk=["id"],
+                columns=file_headers.get(f"{result_name}.csv", []),
+                destination="",
+            ),
+            fix_headers=True,
+            flatten_objects=False,
+            child_separator="__",
+        )
+        self.extraction_time = extraction_time
+
+    def write_ids(self, ids):
+        for record_id in sorted(ids):
+            self.write({"id": record_id, EXTRACTION_TIME: self.extraction_time})
+
+
+class RefundsWriter(CountingResultWriter):
     def __init__(
             self,
             result_dir_path,
@@ -94,7 +282,7 @@ class RefundsWriter(ResultWriter):
         self.result_dir_path = result_dir_path
 
 
-class LineItemsWriter(ResultWriter):
+class LineItemsWriter(CountingResultWriter):
     def __init__(
             self,
             result_dir_path,
@@ -124,7 +312,7 @@ class LineItemsWriter(ResultWriter):
         self.result_dir_path = result_dir_path
         primary_keys = pk + ["line_item_id"]
         # taxes writer
-        self.taxes_writer = ResultWriter(
+        self.taxes_writer = CountingResultWriter(
             result_dir_path,
             KBCTableDef(
                 name=f"{prefix}line_items__taxes",
@@ -137,17 +325,14 @@ class LineItemsWriter(ResultWriter):
             child_separator="__",
         )
         # meta_data writer
-        self.meta_data_writer = ResultWriter(
+        self.meta_data_writer = MetadataWriter(
             result_dir_path,
-            KBCTableDef(
-                name=f"{prefix}line_items__meta_data",
-                pk=primary_keys,
-                columns=file_headers.get(f"{prefix}line_items__meta_data.csv", []),
-                destination="",
-            ),
-            flatten_objects=flatten_metadata,
-            fix_headers=True,
-            child_separator="__",
+            extraction_time,
+            additional_pk=primary_keys[1:],
+            prefix=f"{prefix}line_items__",
+            file_headers=file_headers,
+            flatten_metadata=flatten_metadata,
+            name="meta_data"
         )
 
     def write(
@@ -194,7 +379,7 @@ class LineItemsWriter(ResultWriter):
         super().close()
 
 
-class TaxLinesWriter(ResultWriter):
+class TaxLinesWriter(CountingResultWriter):
     def __init__(
             self,
             result_dir_path,
@@ -224,17 +409,14 @@ class TaxLinesWriter(ResultWriter):
         self.result_dir_path = result_dir_path
         primary_keys = pk + ["tax_lines_id"]
         # meta_data writer
-        self.meta_data_writer = ResultWriter(
+        self.meta_data_writer = MetadataWriter(
             result_dir_path,
-            KBCTableDef(
-                name=f"{prefix}tax_lines__meta_data",
-                pk=primary_keys,
-                columns=file_headers.get(f"{prefix}tax_lines__meta_data.csv", []),
-                destination="",
-            ),
-            flatten_objects=flatten_metadata,
-            fix_headers=True,
-            child_separator="__",
+            extraction_time,
+            additional_pk=primary_keys[1:],
+            prefix=f"{prefix}tax_lines__",
+            file_headers=file_headers,
+            flatten_metadata=flatten_metadata,
+            name="meta_data"
         )
 
     def write(
@@ -270,7 +452,7 @@ class TaxLinesWriter(ResultWriter):
         super().close()
 
 
-class ShippingLinesWriter(ResultWriter):
+class ShippingLinesWriter(CountingResultWriter):
     def __init__(
             self,
             result_dir_path,
@@ -302,7 +484,7 @@ class ShippingLinesWriter(ResultWriter):
 
         # tax_lines writer
         primary_keys = pk + ["shipping_lines_id"]
-        self.taxes_writer = ResultWriter(
+        self.taxes_writer = CountingResultWriter(
             result_dir_path,
             KBCTableDef(
                 name=f"{prefix}shipping_lines__taxes",
@@ -316,17 +498,14 @@ class ShippingLinesWriter(ResultWriter):
         )
 
         # meta_data writer
-        self.meta_data_writer = ResultWriter(
+        self.meta_data_writer = MetadataWriter(
             result_dir_path,
-            KBCTableDef(
-                name=f"{prefix}shipping_lines__meta_data",
-                pk=primary_keys,
-                columns=file_headers.get(f"{prefix}shipping_lines__meta_data.csv", []),
-                destination="",
-            ),
-            flatten_objects=flatten_metadata,
-            fix_headers=True,
-            child_separator="__",
+            extraction_time,
+            additional_pk=primary_keys[1:],
+            prefix=f"{prefix}shipping_lines__",
+            file_headers=file_headers,
+            flatten_metadata=flatten_metadata,
+            name="meta_data"
         )
 
     def write(
@@ -373,7 +552,7 @@ class ShippingLinesWriter(ResultWriter):
         super().close()
 
 
-class CouponLinesWriter(ResultWriter):
+class CouponLinesWriter(CountingResultWriter):
     def __init__(
             self,
             result_dir_path,
@@ -403,17 +582,14 @@ class CouponLinesWriter(ResultWriter):
 
         self.result_dir_path = result_dir_path
         primary_keys = pk + ["coupon_lines_id"]
-        self.meta_data_writer = ResultWriter(
+        self.meta_data_writer = MetadataWriter(
             result_dir_path,
-            KBCTableDef(
-                name=f"{prefix}coupon_lines__meta_data",
-                pk=primary_keys,
-                columns=file_headers.get(f"{prefix}coupon_lines__meta_data.csv", []),
-                destination="",
-            ),
-            flatten_objects=flatten_metadata,
-            fix_headers=True,
-            child_separator="__",
+            extraction_time,
+            additional_pk=primary_keys[1:],
+            prefix=f"{prefix}coupon_lines__",
+            file_headers=file_headers,
+            flatten_metadata=flatten_metadata,
+            name="meta_data"
         )
 
     def write(
@@ -449,7 +625,7 @@ class CouponLinesWriter(ResultWriter):
         super().close()
 
 
-class OrdersWriter(ResultWriter):
+class OrdersWriter(CountingResultWriter):
     def __init__(
             self, result_dir_path, result_name, extraction_time, file_headers=None,
             flatten_metadata=True
@@ -537,7 +713,7 @@ class OrdersWriter(ResultWriter):
     ):
         excludes = ["_links", "customer_user_agent"]
         for field in excludes:
-            data.pop(field)
+            data.pop(field, None)
         order_id = data["id"]
         line_items = data.pop("line_items", [])
         tax_lines = data.pop("self.tax_lines_writer", [])
@@ -605,10 +781,10 @@ class OrdersWriter(ResultWriter):
         super().close()
 
 
-class CustomersWriter(ResultWriter):
+class CustomersWriter(CountingResultWriter):
     def __init__(
             self, result_dir_path, result_name, extraction_time, file_headers=None,
-            flatten_metadata=True
+            flatten_metadata=True, fingerprints=None
     ):
         super().__init__(
             result_dir_path,
@@ -633,6 +809,8 @@ class CustomersWriter(ResultWriter):
         self.extraction_time = extraction_time
         self.user_value_cols = ["extraction_time"]
         self.result_dir_path = result_dir_path
+        # FingerprintStore of the customers written by the previous runs
+        self.fingerprints = fingerprints
 
     def write(
             self,
@@ -642,9 +820,12 @@ class CustomersWriter(ResultWriter):
             object_from_arrays=False,
             write_header=True,
     ):
+        fingerprint = record_hash(data) if self.fingerprints else None
+        if fingerprint is not None and self.fingerprints.unchanged(data.get("id"), fingerprint):
+            return
         excludes = ["_links"]
         for field in excludes:
-            data.pop(field)
+            data.pop(field, None)
         customer_id = data.get("id")
         meta_data = data.pop("meta_data", [])
         self.meta_data_writer.write_all(
@@ -661,6 +842,9 @@ class CustomersWriter(ResultWriter):
             object_from_arrays=object_from_arrays,
             write_header=write_header,
         )
+        if fingerprint is not None:
+            # a record that failed to write is written again by the next run
+            self.fingerprints.update(customer_id, fingerprint)
 
     def collect_results(self):
         results = []
@@ -673,7 +857,102 @@ class CustomersWriter(ResultWriter):
         super().close()
 
 
-class ProductsWriter(ResultWriter):
+class VariationsWriter(CountingResultWriter):
+    def __init__(
+            self,
+            result_dir_path,
+            extraction_time,
+            additional_pk: List[str] = None,
+            prefix: str = "",
+            file_headers=None,
+            flatten_metadata=True
+    ):
+        pk = ["id"]
+        if additional_pk:
+            pk.extend(additional_pk)
+        file_name = f"{prefix}variations"
+        super().__init__(
+            result_dir_path,
+            KBCTableDef(
+                name=file_name,
+                pk=pk,
+                columns=file_headers.get(f"{file_name}.csv", []),
+                destination="",
+            ),
+            fix_headers=True,
+            flatten_objects=True,
+            child_separator="__",
+        )
+        self.extraction_time = extraction_time
+        self.result_dir_path = result_dir_path
+        # attributes of variations have the id 0 unless they are global attributes
+        self.attributes_writer = CountingResultWriter(
+            result_dir_path,
+            KBCTableDef(
+                name=f"{prefix}variations__attributes",
+                pk=pk + ["name", "variation_id"],
+                columns=file_headers.get(f"{prefix}variations__attributes.csv", []),
+                destination="",
+            ),
+            flatten_objects=True,
+            fix_headers=True,
+            child_separator="__",
+        )
+        self.meta_data_writer = MetadataWriter(
+            result_dir_path,
+            extraction_time,
+            additional_pk=["variation_id"],
+            file_headers=file_headers,
+            prefix=f"{prefix}variations__",
+            flatten_metadata=flatten_metadata
+        )
+
+    def write(
+            self,
+            data,
+            file_name=None,
+            user_values=None,
+            object_from_arrays=False,
+            write_header=True,
+    ):
+        variation_id = data["id"]
+        excludes = ["_links", "downloads"]
+        for field in excludes:
+            data.pop(field, None)
+        attributes = data.pop("attributes", [])
+        meta_data = data.pop("meta_data", [])
+        self.attributes_writer.write_all(
+            attributes,
+            user_values={
+                **user_values,
+                "variation_id": variation_id,
+                EXTRACTION_TIME: self.extraction_time,
+            },
+        )
+        self.meta_data_writer.write_all(
+            meta_data,
+            user_values={
+                **user_values,
+                "variation_id": variation_id,
+                EXTRACTION_TIME: self.extraction_time,
+            },
+        )
+        super().write(data, file_name, user_values, object_from_arrays, write_header)
+
+    def collect_results(self):
+        results = []
+        results.extend(self.attributes_writer.collect_results())
+        results.extend(self.meta_data_writer.collect_results())
+        results.extend(super().collect_results())
+        return results
+
+    def close(self):
+        self.attributes_writer.close()
+        self.meta_data_writer.close()
+        super().close()
+
+
+class ProductsWriter(CountingResultWriter):
     def __init__(
             self,
             result_dir_path: str,
@@ -682,7 +961,9 @@ class ProductsWriter(ResultWriter):
             prefix="",
             file_headers=None,
             client=None,
-            flatten_metadata=True
+            flatten_metadata=True,
+            variations_concurrency=0,
+            fingerprints=None
     ):
         self.client = client
         pk = ["id"]
@@ -701,8 +982,10 @@ class ProductsWriter(ResultWriter):
         self.extraction_time = extraction_time
         self.user_value_cols = ["extraction_time"]
         self.result_dir_path = result_dir_path
+        # FingerprintStore of the products written by the previous runs
+        self.fingerprints = fingerprints
         primary_keys = pk + ["product_id"]
-        self.categories_writer = ResultWriter(
+        self.categories_writer = CountingResultWriter(
             result_dir_path,
             KBCTableDef(
                 name=f"{prefix}categories",
@@ -715,7 +998,7 @@ class ProductsWriter(ResultWriter):
             child_separator="__",
         )
 
-        self.images_writer = ResultWriter(
+        self.images_writer = CountingResultWriter(
             result_dir_path,
             KBCTableDef(
                 name=f"{prefix}images",
@@ -728,7 +1011,7 @@ class ProductsWriter(ResultWriter):
             child_separator="__",
         )
 
-        self.attributes_writer = ResultWriter(
+        self.attributes_writer = CountingResultWriter(
             result_dir_path,
             KBCTableDef(
                 name=f"{prefix}attributes",
@@ -741,7 +1024,7 @@ class ProductsWriter(ResultWriter):
             child_separator="__",
         )
 
-        self.default_attributes_writer = ResultWriter(
+        self.default_attributes_writer = CountingResultWriter(
             result_dir_path,
             KBCTableDef(
                 name=f"{prefix}default_attributes",
@@ -754,7 +1037,7 @@ class ProductsWriter(ResultWriter):
             child_separator="__",
         )
 
-        self.tags_writer = ResultWriter(
+        self.tags_writer = CountingResultWriter(
             result_dir_path,
             KBCTableDef(
                 name=f"{prefix}tags",
@@ -774,6 +1057,43 @@ class ProductsWriter(ResultWriter):
             prefix="product__",
             flatten_metadata=flatten_metadata
         )
+        # variations of variable products are fetched by a pool of workers while the products are written,
+        # the fetched variations are written by the thread writing the products
+        self.variations_writer = None
+        if client and variations_concurrency:
+            self.variations_writer = VariationsWriter(
+                result_dir_path,
+                extraction_time,
+                additional_pk=["product_id"],
+                file_headers=file_headers,
+                prefix="product__",
+                flatten_metadata=flatten_metadata
+            )
+            self.variations_executor = ThreadPoolExecutor(max_workers=variations_concurrency)
+            self.max_pending_variations = 2 * variations_concurrency
+            self.pending_variations = collections.deque()
+
+    def write_variations(self, block=False):
+        """
+        Write the variations of the products in the order of the products, as long as they are fetched. At most
+        max_pending_variations products wait for their variations, so a large catalog keeps the memory bounded.
+        """
+        while self.pending_variations:
+            product_id, future = self.pending_variations[0]
+            if not (block or future.done() or len(self.pending_variations) > self.max_pending_variations):
+                return
+            self.pending_variations.popleft()
+            try:
+                for variations in future.result():
+                    self.variations_writer.write_all(
+                        variations,
+                        user_values={
+                            "product_id": product_id,
+                            EXTRACTION_TIME: self.extraction_time,
+                        },
+                    )
+            except Exception as err:
+                logging.error(f"Fail to fetch variations of product {product_id}: {err}")
 
     def write(
             self,
@@ -784,9 +1104,18 @@ class ProductsWriter(ResultWriter):
             write_header=True,
     ):
         product_id = data.get("id", "Not found")
+        # the variations may change without the product, variable products are always written with them
+        with_variations = bool(self.variations_writer and data.get("variations"))
+        fingerprint = record_hash(data) if self.fingerprints else None
+        if fingerprint is not None and not with_variations and self.fingerprints.unchanged(product_id, fingerprint):
+            return
+        if with_variations:
+            self.pending_variations.append((product_id, self.variations_executor.submit(
+                lambda: list(self.client.get_product_variations(product_id)))))
+            self.write_variations()
         excludes = ["_links", "downloads"]
         for field in excludes:
-            data.pop(field)
+            data.pop(field, None)
         categories = data.pop("categories", [])
         images = data.pop("images", [])
         attributes = data.pop("attributes", [])
@@ -836,6 +1165,9 @@ class ProductsWriter(ResultWriter):
             },
         )
         super().write(data, file_name, user_values, object_from_arrays, write_header)
+        if fingerprint is not None:
+            # a record that failed to write is written again by the next run
+            self.fingerprints.update(product_id, fingerprint)
 
     def collect_results(self):
         results = []
@@ -845,10 +1177,16 @@ class ProductsWriter(ResultWriter):
         results.extend(self.default_attributes_writer.collect_results())
         results.extend(self.tags_writer.collect_results())
         results.extend(self.meta_data_writer.collect_results())
+        if self.variations_writer:
+            results.extend(self.variations_writer.collect_results())
         results.extend(super().collect_results())
         return results
 
     def close(self):
+        if self.variations_writer:
+            self.write_variations(block=True)
+            self.variations_executor.shutdown()
+            self.variations_writer.close()
         self.categories_writer.close()
         self.images_writer.close()
         self.attributes_writer.close()
@@ -0,0 +1,54 @@
+import csv
+import gzip
+import logging
+import os
+import shutil
+
+# slices are rotated by uncompressed size, Storage loads the slices of a table in parallel
+DEFAULT_SLICE_SIZE_MB = 128
+# speed of the job over the size of the upload
+SLICE_COMPRESS_LEVEL = 4
+
+
+def slice_table(full_path: str, max_bytes: int, max_rows: int = None) -> list:
+    """
+    Replace the CSV file with a folder of the same name holding gzip compressed slices without header, the layout
+    of sliced tables in Keboola. Returns the header of the file, the columns of the manifest of the sliced table.
+    """
+    source_path = f"{full_path}.source"
+    os.replace(full_path, source_path)
+    os.makedirs(full_path)
+    table_name = os.path.splitext(os.path.basename(full_path))[0]
+    slices = 0
+    slice_file = writer = None
+    try:
+        with open(source_path, newline="", encoding="utf-8") as source:
+            reader = csv.reader(source)
+            header = next(reader, [])
+            slice_bytes = slice_rows = 0
+            for row in reader:
+                if writer is None or slice_bytes >= max_bytes or (max_rows and slice_rows >= max_rows):
+                    if slice_file:
+                        slice_file.close()
+                    slices += 1
+                    slice_file = gzip.open(os.path.join(full_path, f"{table_name}_{slices:04d}.csv.gz"), "wt",
+                                           newline="", encoding="utf-8", compresslevel=SLICE_COMPRESS_LEVEL)
+                    writer = csv.writer(slice_file)
+                    slice_bytes = slice_rows = 0
+                slice_bytes += writer.writerow(row)
+                slice_rows += 1
+        if not slices:
+            # an empty table still needs a slice
+            slices = 1
+            gzip.open(os.path.join(full_path, f"{table_name}_0001.csv.gz"), "wt").close()
+    except Exception:
+        if slice_file:
+            slice_file.close()
+        shutil.rmtree(full_path)
+        os.replace(source_path, full_path)
+        raise
+    if slice_file:
+        slice_file.close()
+    os.remove(source_path)
+    logging.debug(f"Sliced {os.path.basename(full_path)} into {slices} slices")
+    return header
@@ -1,18 +1,92 @@
+import collections
 import datetime
 import functools
+import itertools
+import json
 import logging
 import math
+import queue
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 
 import backoff
 import requests
 from requests import Response
+from requests.adapters import HTTPAdapter
 from woocommerce import API
+from woocommerce.api import __version__ as woocommerce_api_version
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from cassette import Cassette, CassetteSession
+from metrics import RunMetrics, metrics_endpoint
+from page_tuner import PageSizeTuner, DEFAULT_MAX_PAGE_SIZE, MIN_PAGE_SIZE, MAX_TIMEOUT, PROBED_MAX_PAGE_SIZE
+from rate_limiter import AdaptiveRateLimiter
 
 RESULTS_PER_PAGE = 100
 
 # We will retry a 500 error a maximum of 5 times before giving up
 MAX_RETRIES = 5
+# Exponential backoff between retries of a single page request, in seconds
+RETRY_BACKOFF_FACTOR = 2
+MAX_RETRY_WAIT = 120
+
+# Number of pages fetched in parallel once the total page count is known
+DEFAULT_CONCURRENCY = 1
+
+# Date windows holding more records than this are split further by the date window planner
+DEFAULT_MAX_WINDOW_RECORDS = 1000
+# Windows are never split below the resolution of the after/before filters
+MIN_WINDOW_LENGTH = datetime.timedelta(seconds=1)
+# Without an end date the last window is open-ended, its planned end only splits the windows and is ahead of the
+# local time of any store, whose date filters compare to the local time unless dates_are_gmt is set
+OPEN_END_AHEAD = datetime.timedelta(days=1)
+
+# Filters of the id scans, the records of the downloads without the date filters
+ID_SCAN_PARAMS = {"orders": {"status": "any"}, "products": {"status": "any"}, "customers": {"role": "all"}}
+# Ids requested at once with the include filter
+INCLUDE_BATCH_SIZE = 100
+
+# Order statuses of a store without custom statuses, used when the statuses can't be read from the orders report
+ORDER_STATUSES = ["pending", "processing", "on-hold", "completed", "cancelled", "refunded", "failed", "checkout-draft"]
+
+# Fields of the wc/v3 resources written by the result writers, used as the default _fields projection
+ORDER_FIELDS = [
+    "id", "parent_id", "number", "order_key", "created_via", "version", "status", "currency", "currency_symbol",
+    "date_created", "date_created_gmt", "date_modified", "date_modified_gmt", "discount_total", "discount_tax",
+    "shipping_total", "shipping_tax", "cart_tax", "total", "total_tax", "prices_include_tax", "customer_id",
+    "customer_ip_address", "customer_note", "billing", "shipping", "payment_method", "payment_method_title",
+    "transaction_id", "date_paid", "date_paid_gmt", "date_completed", "date_completed_gmt", "cart_hash",
+    "payment_url", "is_editable", "needs_payment", "needs_processing", "meta_data", "line_items", "tax_lines",
+    "shipping_lines", "fee_lines", "coupon_lines", "refunds"
+]
+PRODUCT_FIELDS = [
+    "id", "name", "slug", "permalink", "date_created", "date_created_gmt", "date_modified", "date_modified_gmt",
+    "type", "status", "featured", "catalog_visibility", "description", "short_description", "sku", "global_unique_id",
+    "price", "regular_price", "sale_price", "date_on_sale_from", "date_on_sale_from_gmt", "date_on_sale_to",
+    "date_on_sale_to_gmt", "price_html", "on_sale", "purchasable", "total_sales", "virtual", "downloadable",
+    "download_limit", "download_expiry", "external_url", "button_text", "tax_status", "tax_class", "manage_stock",
+    "stock_quantity", "stock_status", "backorders", "backorders_allowed", "backordered", "low_stock_amount",
+    "sold_individually", "weight", "dimensions", "shipping_required", "shipping_taxable", "shipping_class",
+    "shipping_class_id", "reviews_allowed", "average_rating", "rating_count", "related_ids", "upsell_ids",
+    "cross_sell_ids", "parent_id", "purchase_note", "categories", "tags", "images", "attributes",
+    "default_attributes", "variations", "grouped_products", "menu_order", "has_options", "post_password", "meta_data"
+]
+CUSTOMER_FIELDS = [
+    "id", "date_created", "date_created_gmt", "date_modified", "date_modified_gmt", "email", "first_name",
+    "last_name", "role", "username", "billing", "shipping", "is_paying_customer", "avatar_url", "meta_data"
+]
+DEFAULT_FIELDS = {
+    "orders": ORDER_FIELDS,
+    "products": PRODUCT_FIELDS,
+    "customers": CUSTOMER_FIELDS
+}
 
 
 class ConnectionError(Exception):
@@ -31,59 +105,100 @@ class UnauthorizedError(Exception):
     pass
 
 
-def is_not_status_code_fn(status_code):
-    def gen_fn(exc):
-        if getattr(exc, "code", None) and exc.code not in status_code or getattr(exc, "code", None) is None:
-            return True
-        # Retry other errors up to the max
+def is_retryable_error(exc):
+    if isinstance(exc, requests.exceptions.SSLError):
         return False
-
-    return gen_fn
-
-
-def leaky_bucket_handler(details):
-    logging.info("Received 429 -- sleeping for %s seconds", details["wait"])
+    response = getattr(exc, "response", None)
+    if response is None:
+        # timeouts and dropped connections
+        return True
+    return response.status_code == 429 or 500 <= response.status_code < 600
+
+
+def is_page_size_error(exc):
+    """
+    Errors of pages too heavy for the store to render in time, throttling is not solved by smaller pages
+    """
+    if isinstance(exc, requests.exceptions.Timeout):
+        return True
+    response = getattr(exc, "response", None)
+    return response is not None and response.status_code in (500, 502, 504)
+
+
+def received_bytes(response):
+    """
+    Size of the response body as received over the wire, before the gzip or deflate decoding
+    """
+    # urllib3 counts the bytes read from the connection, the decoded content is several times larger
+    raw = getattr(response, "raw", None)
+    received = raw.tell() if hasattr(raw, "tell") else None
+    if isinstance(received, int) and received > 0:
+        return received
+    return len(response.content)
+
+
+def get_retry_after(exc):
+    """
+    Returns the number of seconds requested by the Retry-After header of the failed response, None if not present
+    """
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    return get_response_retry_after(response)
+
+
+def get_response_retry_after(response):
+    # It's been observed to come through as lowercase, so fallback if not present
+    sleep_time_str = response.headers.get("Retry-After", response.headers.get("retry-after"))
+    try:
+        return max(0.0, float(sleep_time_str))
+    except (TypeError, ValueError):
+        return None
 
 
 def retry_handler(details):
+    response = getattr(sys.exc_info()[1], "response", None)
+    status = response.status_code if response is not None else "connection error"
     logging.info(
-        "Received 500 or retryable error -- Retry %s/%s", details["tries"], MAX_RETRIES
+        "Received %s -- Retry %s/%s in %.1f seconds", status, details["tries"], MAX_RETRIES, details["wait"]
     )
+    # retried client methods take the endpoint as the first argument
+    metrics = getattr(details["args"][0], "metrics", None) if len(details["args"]) > 1 else None
+    if isinstance(metrics, RunMetrics):
+        metrics.add(metrics_endpoint(details["args"][1]), retries=1)
 
 
 # pylint: disable=unused-argument
-def retry_after_wait_gen(**kwargs):
-    # This is called in an except block so we can retrieve the exception
-    # and check it.
-    exc_info = sys.exc_info()
-    if not exc_info[1].response:
-        return 0
-    resp = exc_info[1].response
-    # Retry-After is an undocumented header. But honoring
-    # it was proven to work in our spikes.
-    # It's been observed to come through as lowercase, so fallback if not present
-    sleep_time_str = resp.headers.get("Retry-After", resp.headers.get("retry-after"))
-    yield math.floor(float(sleep_time_str) * 2)
+def retry_wait_gen(**kwargs):
+    """
+    Exponential backoff with full jitter, a Retry-After header of the failed response takes precedence
+    """
+    expo = backoff.expo(factor=RETRY_BACKOFF_FACTOR, max_value=MAX_RETRY_WAIT)
+    while True:
+        wait = backoff.full_jitter(next(expo))
+        # This is called in an except block so we can retrieve the exception
+        # and check it.
+        retry_after = get_retry_after(sys.exc_info()[1])
+        yield wait if retry_after is None else retry_after
 
 
 def error_handling(fnc):
+    """
+    Retries a single request on timeouts, connection errors, 429 and 5xx responses
+    """
+
     @backoff.on_exception(
-        backoff.expo,
+        retry_wait_gen,
         (
                 requests.exceptions.HTTPError,
                 requests.exceptions.Timeout,
-                requests.exceptions.ConnectionError
+                requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError
         ),
-        giveup=is_not_status_code_fn(range(500, 599)),
+        giveup=lambda exc: not is_retryable_error(exc),
         on_backoff=retry_handler,
         max_tries=MAX_RETRIES,
-    )
-    @backoff.on_exception(
-        retry_after_wait_gen,
-        requests.exceptions.ConnectionError,
-        giveup=is_not_status_code_fn([429, None]),
-        on_backoff=leaky_bucket_handler,
-        # No jitter as we want a constant value
+        # Jitter is applied in retry_wait_gen so that Retry-After is honored exactly
         jitter=None,
     )
     @functools.wraps(fnc)
@@ -112,6 +227,161 @@ def response_error_handling(func):
     return wrapper
 
 
+def decode_json(response):
+    """
+    Decode the JSON body of a response. With orjson installed the raw bytes are parsed directly, which skips
+    the copy of the body decoded to str and parses several times faster than the json module. Bodies orjson
+    rejects, e.g. with a BOM or integers over 64 bits, are decoded by requests.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(response.content)
+        except orjson.JSONDecodeError:
+            pass
+    return response.json()
+
+
+def without_empty_dates(params):
+    """
+    Leaves out the after and before filters without a date, urlencode would send them as the string None
+    """
+    return {key: value for key, value in params.items() if key not in ("after", "before") or value}
+
+
+def release_records(page):
+    """
+    Yield the records of a page one at a time in page order, removing each from the page, so that the memory
+    of a written record is freed while the rest of the page is processed
+    """
+    page.reverse()
+    while page:
+        yield page.pop()
+
+
+def ordered_parallel_map(fnc, items, workers):
+    """
+    Apply fnc to items using a pool of workers and yield the results in the order of items.
+    At most 2 * workers calls are in flight at once, so a slow consumer keeps the memory bounded.
+    """
+    items = iter(items)
+    if workers <= 1:
+        for item in items:
+            yield fnc(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque(executor.submit(fnc, item) for item in itertools.islice(items, workers * 2))
+        try:
+            while pending:
+                result = pending.popleft().result()
+                for item in itertools.islice(items, 1):
+                    pending.append(executor.submit(fnc, item))
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def prefetch(iterable, max_size):
+    """
+    Iterate the iterable in a background thread, holding at most max_size items ahead of the consumer.
+    Exceptions of the background thread are raised to the consumer.
+    """
+    end = object()
+    buffer = queue.Queue(maxsize=max(1, max_size))
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((end, None))
+        except Exception as err:
+            put((end, err))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+
+class PooledAPI(API):
+    """
+    woocommerce.API sending the requests through a persistent requests.Session. Connections to the store are kept
+    alive and reused instead of paying a new TCP and TLS handshake for every page.
+    """
+
+    def __init__(self, url, consumer_key, consumer_secret, pool_size=DEFAULT_CONCURRENCY, **kwargs):
+        super().__init__(url, consumer_key, consumer_secret, **kwargs)
+        self.http_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.http_session.mount("https://", adapter)
+        self.http_session.mount("http://", adapter)
+
+    # overrides the private API.__request, which sends each request through a new session
+    def _API__request(self, method, endpoint, data, params=None, **kwargs):
+        # API.__request adds the keys to the params of the caller in query string auth mode
+        params = dict(params or {})
+        timeout = kwargs.pop("timeout", self.timeout)
+        url = self._API__get_url(endpoint)
+        auth = None
+        headers = {
+            "user-agent": "WooCommerce API Client-Python/%s" % woocommerce_api_version,
+            "accept": "application/json"
+        }
+
+        if self.is_ssl is True and self.query_string_auth is False:
+            auth = (self.consumer_key, self.consumer_secret)
+        elif self.is_ssl is True and self.query_string_auth is True:
+            params.update({
+                "consumer_key": self.consumer_key,
+                "consumer_secret": self.consumer_secret
+            })
+        else:
+            encoded_params = urlencode(params)
+            url = "%s?%s" % (url, encoded_params)
+            url = self._API__get_oauth_url(url, method, **kwargs)
+
+        if data is not None:
+            data = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            headers["content-type"] = "application/json;charset=utf-8"
+
+        # the session adds the keep-alive and gzip, deflate Accept-Encoding headers
+        return self.http_session.request(
+            method=method,
+            url=url,
+            verify=self.verify_ssl,
+            auth=auth,
+            params=params,
+            data=data,
+            timeout=timeout,
+            headers=headers,
+            **kwargs
+        )
+
+    def close(self):
+        self.http_session.close()
+
+
 class WooCommerceClient:
     def __init__(
             self,
@@ -120,27 +390,59 @@ class WooCommerceClient:
             consumer_secret: str,
             version: str = "wc/v3",
             authenticate: bool = True,
-            query_string_auth: bool = False
+            query_string_auth: bool = False,
+            concurrency: int = DEFAULT_CONCURRENCY,
+            max_window_records: int = None,
+            fields: dict = None,
+            cassette: Cassette = None,
+            rate_limiter: AdaptiveRateLimiter = None,
+            adaptive_page_size: bool = False,
+            pool_size: int = None,
+            metrics: RunMetrics = None,
+            status_sharding: bool = False
     ):
-        self.session = API(
-            url=url,
-            consumer_key=consumer_key,
-            timeout=120,
-            consumer_secret=consumer_secret,
-            version=version,
-            query_string_auth=query_string_auth
-        )
+        self.concurrency = max(1, concurrency)
+        # shared by the clients of all endpoints
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics or RunMetrics()
+        self.adaptive_page_size = adaptive_page_size
+        # endpoint -> PageSizeTuner, created with the first adaptive download of the endpoint
+        self.page_tuners = {}
+        self._page_tuners_lock = threading.Lock()
+        self.max_window_records = max_window_records
+        self.status_sharding = status_sharding
+        # endpoint -> list of fields requested with the _fields parameter, endpoints not present are not projected
+        self.fields = fields or {}
+        if cassette and cassette.replaying:
+            # no connection to the store is opened
+            self.session = CassetteSession(cassette)
+        else:
+            self.session = PooledAPI(
+                url=url,
+                consumer_key=consumer_key,
+                timeout=MAX_TIMEOUT,
+                consumer_secret=consumer_secret,
+                version=version,
+                query_string_auth=query_string_auth,
+                pool_size=max(self.concurrency, pool_size or 0)
+            )
+            if cassette:
+                self.session = CassetteSession(cassette, self.session)
         if authenticate:
-            response = self.session.get("")
-            self._handle_response(response)
+            self._authenticate()
 
-    def _handle_response(self, response: Response):
+    def close(self):
+        self.session.close()
+
+    def _authenticate(self):
+        """
+        Verify the credentials with the smallest possible authenticated request,
+        instead of downloading the whole API route index
+        """
+        start = time.perf_counter()
         try:
-            if response.status_code == 401:
-                r = response.json()
-                msg = f"message: {r['message']} error: {r['code']} status: {r['data']['status']}"
-                raise UnauthorizedError(msg)
-            response.raise_for_status()
+            response = self.session.get("orders", params={"per_page": 1, "_fields": "id"})
+            self._handle_response(response)
         except requests.exceptions.SSLError as err:
             logging.error(err)
             raise HTTPSProtocolError(
@@ -151,29 +453,333 @@ class WooCommerceClient:
             raise ConnectionError(
                 "Failed to establish a connection, please correct and verify the store_url"
             ) from err
+        logging.info(f"Authenticated in {time.perf_counter() - start:.2f} s")
+
+    def _handle_response(self, response: Response):
+        if response.status_code == 401:
+            r = response.json()
+            msg = f"message: {r['message']} error: {r['code']} status: {r['data']['status']}"
+            raise UnauthorizedError(msg)
+        response.raise_for_status()
+
+    def _fetch_data(self, endpoint, params, concurrency=None, checkpoint=None):
+        """
+        Fetch all data, pages after the first one are fetched by a pool of concurrency workers
+        and yielded in page order. Failed requests are retried per page, so a failure never restarts the download.
+        With a checkpoint the pages completed by a previous run are skipped and the download stops
+        once the checkpoint deadline is reached.
+        """
+        params = without_empty_dates(params)
+        # completed pages of a checkpoint are counted in pages of a fixed size and nested endpoints such as product
+        # variations hold a few records per parent
+        if self.adaptive_page_size and not checkpoint and "/" not in endpoint:
+            yield from self._fetch_adaptive(endpoint, params, concurrency)
+            return
+        first_page = 1
+        if checkpoint:
+            # records created during the download are appended to the last page and don't shift completed pages
+            params = {**params, "orderby": "id", "order": "asc"}
+            first_page = checkpoint.completed_pages + 1
+            completed_records = checkpoint.completed_pages * params["per_page"]
+            if completed_records and self._count_records(endpoint, params) <= completed_records:
+                checkpoint.finish()
+                return
+        response = self._get(endpoint, {**params, "page": first_page})
+        if response.status_code != 200:
+            return
+        total_pages = int(response.headers.get("X-WP-TotalPages", 1))
+        remaining_pages = ordered_parallel_map(
+            functools.partial(self._get_page, endpoint, params),
+            range(first_page + 1, total_pages + 1),
+            concurrency or self.concurrency
+        )
+        try:
+            pages = itertools.chain([self._decode(endpoint, response)], remaining_pages)
+            for page, data in enumerate(pages, start=first_page):
+                if data is not None:
+                    yield data
+                if checkpoint:
+                    checkpoint.complete_page(page)
+                    if page < total_pages and checkpoint.expired():
+                        checkpoint.stop()
+                        return
+        finally:
+            remaining_pages.close()
+        if checkpoint:
+            checkpoint.finish()
 
     @error_handling
-    def _fetch_data(self, endpoint, params):
+    def _get(self, endpoint, params, **kwargs):
+        return self._request(endpoint, params, **kwargs)
+
+    def _request(self, endpoint, params, **kwargs):
         """
-        Fetch all data
+        Send a single request without retries, kwargs such as timeout are passed to the session
         """
-        page_count = 1
-        # if any date_from or date_to is None then download all data for orders and products
-        if endpoint in ["orders", "products"] and not (params.get("after") or params.get("before")):
-            params.pop("after")
-            params.pop("before")
-        response = self.session.get(endpoint, params=params)
+        fields = self.fields.get(endpoint)
+        if fields and "_fields" not in params:
+            params = {**params, "_fields": ",".join(fields)}
+        metric = metrics_endpoint(endpoint)
+        if self.rate_limiter:
+            with self.metrics.timer(metric, "rate_limit_wait"):
+                self.rate_limiter.acquire()
+        start = time.monotonic()
+        try:
+            response = self.session.get(endpoint, params=params, **kwargs)
+        except requests.exceptions.Timeout:
+            self.metrics.add(metric, timeouts=1)
+            if self.rate_limiter:
+                self.rate_limiter.on_timeout()
+            raise
+        latency = time.monotonic() - start
+        self.metrics.add(metric, requests=1, http_seconds=latency, bytes=received_bytes(response),
+                         throttled=int(response.status_code == 429))
+        if self.rate_limiter:
+            self.rate_limiter.on_response(response.status_code, latency, get_response_retry_after(response))
         self._handle_response(response)
+        return response
+
+    def _decode(self, endpoint, response):
+        with self.metrics.timer(metrics_endpoint(endpoint), "decode"):
+            return decode_json(response)
+
+    def _get_page(self, endpoint, params, page):
+        """
+        Fetch single page, returns None if the page has no content
+        """
+        response = self._get(endpoint, {**params, "page": page})
         if response.status_code == 200:
-            yield response.json()
-            total_pages = int(response.headers.get("X-WP-TotalPages", 1))
-            while page_count < total_pages:
-                page_count += 1
-                params["page"] = page_count
-                response = self.session.get(endpoint, params=params)
-                response.raise_for_status()
-                if response.status_code == 200:
-                    yield response.json()
+            return self._decode(endpoint, response)
+        return None
+
+    def _fetch_adaptive(self, endpoint, params, concurrency=None):
+        """
+        Fetch all data in pages of the size adapted to the store by the endpoint PageSizeTuner. The pages are
+        addressed by record offset, so that pages of different sizes adjoin, and a page failing with a timeout
+        or a server error is split in halves.
+        """
+        tuner = self._page_tuner(endpoint, params)
+        params = {key: value for key, value in params.items() if key not in ("per_page", "page")}
+        total = self._count_records(endpoint, params)
+
+        def chunks():
+            offset = 0
+            while offset < total:
+                # the size is read when the chunk is scheduled, so it follows the tuner
+                size = tuner.per_page
+                yield offset, size
+                offset += size
+
+        results = ordered_parallel_map(
+            functools.partial(self._get_chunk, endpoint, params, tuner, total), chunks(),
+            concurrency or self.concurrency
+        )
+        try:
+            for records in results:
+                if records:
+                    yield records
+        finally:
+            results.close()
+
+    def _page_tuner(self, endpoint, params):
+        with self._page_tuners_lock:
+            if endpoint not in self.page_tuners:
+                self.page_tuners[endpoint] = PageSizeTuner(
+                    endpoint, params.get("per_page", RESULTS_PER_PAGE), self._probe_max_page_size(endpoint, params)
+                )
+            return self.page_tuners[endpoint]
+
+    def _probe_max_page_size(self, endpoint, params):
+        """
+        Stores reject pages larger than 100 records with 400 unless the limit is raised by a filter
+        """
+        try:
+            response = self._request(endpoint, {**params, "per_page": PROBED_MAX_PAGE_SIZE, "page": 1, "_fields": "id"})
+        except requests.exceptions.RequestException:
+            return DEFAULT_MAX_PAGE_SIZE
+        # some stores cap per_page without an error, the page is then shorter than the records available
+        records = self._decode(endpoint, response) or []
+        expected = min(PROBED_MAX_PAGE_SIZE, int(response.headers.get("X-WP-Total", PROBED_MAX_PAGE_SIZE)))
+        if len(records) < expected:
+            if not records:
+                return DEFAULT_MAX_PAGE_SIZE
+            logging.info(f"The store returns at most {len(records)} {endpoint} per page")
+            return len(records)
+        logging.info(f"The store allows pages of up to {PROBED_MAX_PAGE_SIZE} {endpoint}")
+        return PROBED_MAX_PAGE_SIZE
+
+    def _get_chunk(self, endpoint, params, tuner, total, chunk):
+        """
+        Fetch size records starting at offset. A page shorter than the records left means the store caps per_page,
+        the rest of the chunk is then fetched in pages of the size the store returns.
+        """
+        offset, size = chunk
+        records = self._fetch_chunk(endpoint, params, tuner, total, offset, size)
+        expected = min(size, total - offset)
+        if records and len(records) < expected:
+            tuner.limit(len(records), f"the store returned {len(records)} of {expected} records")
+            records = records + self._get_chunk(endpoint, params, tuner, total,
+                                                (offset + len(records), size - len(records)))
+        return records
+
+    def _fetch_chunk(self, endpoint, params, tuner, total, offset, size):
+        """
+        A failing chunk is split in halves down to MIN_PAGE_SIZE records, the smallest chunks are retried as usual
+        """
+        chunk_params = {**params, "offset": offset, "per_page": size}
+        if size <= MIN_PAGE_SIZE:
+            return self._decode(endpoint, self._get(endpoint, chunk_params, timeout=MAX_TIMEOUT))
+        start = time.monotonic()
+        try:
+            response = self._request(endpoint, chunk_params, timeout=tuner.timeout)
+        except requests.exceptions.SSLError:
+            raise
+        except requests.exceptions.RequestException as err:
+            # dropped connections and the other errors are retried as usual
+            if not is_page_size_error(err):
+                return self._decode(endpoint, self._get(endpoint, chunk_params, timeout=MAX_TIMEOUT))
+            tuner.shrink(size, f"page of {size} failed with {err.__class__.__name__}")
+            half = math.ceil(size / 2)
+            return self._get_chunk(endpoint, params, tuner, total, (offset, half)) + \
+                self._get_chunk(endpoint, params, tuner, total, (offset + half, size - half))
+        tuner.observe(size, time.monotonic() - start)
+        return self._decode(endpoint, response)
+
+    def _count_records(self, endpoint, params):
+        response = self._get(endpoint, {**params, "per_page": 1, "page": 1, "_fields": "id"})
+        return int(response.headers.get("X-WP-Total", 0))
+
+    def _oldest_record_date(self, endpoint, params):
+        params = {key: value for key, value in params.items() if key not in ("after", "before")}
+        response = self._get(endpoint, {**params, "per_page": 1, "page": 1, "order": "asc", "orderby": "date",
+                                        "_fields": "id,date_created"})
+        data = response.json() if response.status_code == 200 else []
+        if not data:
+            return None
+        return datetime.datetime.fromisoformat(data[0]["date_created"])
+
+    @staticmethod
+    def _window_params(params, window, open_end=None):
+        start, end = window
+        # after and before are exclusive and have a resolution of one second, shifting after by a second
+        # makes the windows [start, end) adjoin without gaps
+        window_params = {key: value for key, value in params.items() if key != "before"}
+        window_params["after"] = (start - MIN_WINDOW_LENGTH).isoformat()
+        if end != open_end:
+            window_params["before"] = end.isoformat()
+        return window_params
+
+    def plan_date_windows(self, endpoint, params, date_from, date_to, open_end=None):
+        """
+        Split [date_from, date_to) into windows holding at most self.max_window_records records each.
+        Each window is probed with a per_page=1 request reading X-WP-Total, windows that are still too large
+        are bisected and probed again. Empty windows are dropped. Windows ending at open_end are requested
+        without the before filter.
+        """
+        windows = []
+        candidates = [(date_from, date_to)]
+        while candidates:
+            counts = ordered_parallel_map(
+                lambda window: self._count_records(endpoint, self._window_params(params, window, open_end)),
+                candidates,
+                self.concurrency
+            )
+            next_candidates = []
+            for (start, end), count in zip(candidates, counts):
+                if count == 0:
+                    continue
+                if count <= self.max_window_records or end - start <= MIN_WINDOW_LENGTH:
+                    windows.append((start, end))
+                else:
+                    middle = start + datetime.timedelta(seconds=(end - start).total_seconds() // 2)
+                    next_candidates.extend([(start, middle), (middle, end)])
+            candidates = next_candidates
+        return sorted(windows)
+
+    def _fetch_window(self, endpoint, params, open_end, window):
+        return list(self._fetch_data(endpoint, self._window_params(params, window, open_end), concurrency=1))
+
+    def _fetch_date_windows(self, endpoint, params, checkpoint=None):
+        """
+        Fetch all data split into date windows, windows are fetched in parallel and yielded in date order.
+        Missing date_from is replaced by the date of the oldest record, without date_to the last window has no end
+        so that the newest records are downloaded whatever the time zone of the store.
+        With a checkpoint the windows completed by a previous run are skipped and the download stops
+        once the checkpoint deadline is reached.
+        """
+        if params.get("after"):
+            date_from = datetime.datetime.fromisoformat(params["after"])
+        else:
+            date_from = self._oldest_record_date(endpoint, params)
+        open_end = None
+        if params.get("before"):
+            date_to = datetime.datetime.fromisoformat(params["before"])
+        else:
+            date_to = open_end = datetime.datetime.utcnow().replace(microsecond=0) + OPEN_END_AHEAD
+
+        windows = []
+        if date_from is not None:
+            ranges = checkpoint.remaining_ranges(date_from, date_to) if checkpoint else [(date_from, date_to)]
+            for start, end in ranges:
+                windows.extend(self.plan_date_windows(endpoint, params, start, end, open_end))
+            logging.info(f"Downloading {endpoint} from {date_from.isoformat()} to {date_to.isoformat()} "
+                         f"in {len(windows)} date windows")
+
+        results = ordered_parallel_map(
+            functools.partial(self._fetch_window, endpoint, params, open_end), windows, self.concurrency
+        )
+        try:
+            for index, (window, pages) in enumerate(zip(windows, results), start=1):
+                yield from pages
+                if checkpoint:
+                    checkpoint.complete_window(*window)
+                    if index < len(windows) and checkpoint.expired():
+                        checkpoint.stop()
+                        return
+        finally:
+            results.close()
+        if checkpoint:
+            checkpoint.finish()
+
+    def _order_statuses(self):
+        """
+        Slugs of the order statuses of the store including the custom ones, the orders report needs the permission
+        to view the reports
+        """
+        try:
+            return [total["slug"] for total in self._decode("reports/orders/totals",
+                                                            self._get("reports/orders/totals", {}))]
+        except (requests.exceptions.RequestException, UnauthorizedError, ValueError, KeyError, TypeError) as err:
+            logging.info(f"Failed to read the order statuses from the orders report ({err}), using the default ones")
+            return ORDER_STATUSES
+
+    def _fetch_status_shards(self, endpoint, params):
+        """
+        Fetch the orders of each status as a separate shard counted with X-WP-Total. The pages of all shards are
+        fetched by one pool of workers, the pages of the largest shards first, so that the workers get the same
+        number of records whatever the sizes of the shards.
+        """
+        params = without_empty_dates(params)
+        statuses = self._order_statuses()
+        counts = ordered_parallel_map(
+            lambda status: self._count_records(endpoint, {**params, "status": status}), statuses, self.concurrency
+        )
+        shards = sorted(((count, status) for status, count in zip(statuses, counts) if count), reverse=True)
+        logging.info(f"Downloading {endpoint} in {len(shards)} status shards: "
+                     f"{', '.join(f'{status} ({count})' for count, status in shards)}")
+        pages = [(status, page) for count, status in shards
+                 for page in range(1, math.ceil(count / params["per_page"]) + 1)]
+        results = ordered_parallel_map(
+            lambda shard_page: self._get_page(endpoint, {**params, "status": shard_page[0]}, shard_page[1]),
+            pages,
+            self.concurrency
+        )
+        try:
+            for data in results:
+                if data:
+                    yield data
+        finally:
+            results.close()
 
     def get_orders(
             self,
@@ -182,8 +788,12 @@ class WooCommerceClient:
             status: str = "any",
             per_page: int = RESULTS_PER_PAGE,
             custom_incremental_field: str = None,
-            custom_incremental_date: str = None
+            custom_incremental_date: str = None,
+            checkpoint=None,
+            dates_are_gmt: bool = False
     ):
+        # the pages of resumable downloads are tracked in a single sequence
+        shard_statuses = self.status_sharding and status == "any" and not checkpoint
         if custom_incremental_field and custom_incremental_date:
             params = {
                 "per_page": per_page,
@@ -192,6 +802,8 @@ class WooCommerceClient:
                 "before": None,
                 custom_incremental_field: custom_incremental_date
             }
+            if dates_are_gmt:
+                params["dates_are_gmt"] = "true"
         else:
             params = {
                 "per_page": per_page,
@@ -199,7 +811,11 @@ class WooCommerceClient:
                 "after": date_from,
                 "before": date_to,
             }
-        return self._fetch_data("orders", params)
+            if self.max_window_records and not shard_statuses:
+                return self._fetch_date_windows("orders", params, checkpoint=checkpoint)
+        if shard_statuses:
+            return self._fetch_status_shards("orders", params)
+        return self._fetch_data("orders", params, checkpoint=checkpoint)
 
     def get_products(
             self,
@@ -208,7 +824,9 @@ class WooCommerceClient:
             status: str = "any",
             per_page: int = RESULTS_PER_PAGE,
             custom_incremental_field: str = None,
-            custom_incremental_date: str = None
+            custom_incremental_date: str = None,
+            checkpoint=None,
+            dates_are_gmt: bool = False
     ):
         if custom_incremental_field and custom_incremental_date:
             params = {
@@ -218,6 +836,8 @@ class WooCommerceClient:
                 "before": None,
                 custom_incremental_field: custom_incremental_date
             }
+            if dates_are_gmt:
+                params["dates_are_gmt"] = "true"
         else:
             params = {
                 "per_page": per_page,
@@ -225,13 +845,78 @@ class WooCommerceClient:
                 "after": date_from,
                 "before": date_to,
             }
-        data = self._fetch_data("products", params)
+            if self.max_window_records:
+                return self._fetch_date_windows("products", params, checkpoint=checkpoint)
+        data = self._fetch_data("products", params, checkpoint=checkpoint)
         return data
 
-    def get_customers(self, per_page: int = RESULTS_PER_PAGE):
+    def get_product_variations(self, product_id, per_page: int = RESULTS_PER_PAGE):
+        """
+        Get all variations of a variable product, the pages of a single product are fetched one after another
+        """
+        return self._fetch_data(f"products/{product_id}/variations", {"per_page": per_page}, concurrency=1)
+
+    def get_record_ids(self, endpoint):
+        """
+        Ids of all records of the endpoint, only the ids are requested in the largest pages the store allows
+        """
+        params = {**ID_SCAN_PARAMS[endpoint], "orderby": "id", "order": "asc", "_fields": "id"}
+        params["per_page"] = self._probe_max_page_size(endpoint, params)
+        response = self._get(endpoint, {**params, "page": 1})
+        total_pages = int(response.headers.get("X-WP-TotalPages", 1))
+        remaining_pages = ordered_parallel_map(
+            functools.partial(self._get_page, endpoint, params), range(2, total_pages + 1), self.concurrency
+        )
+        ids = set()
+        try:
+            for page in itertools.chain([self._decode(endpoint, response)], remaining_pages):
+                if page is None:
+                    # an incomplete list would report the missing records as deleted
+                    raise WooCommerceClientError(f"Failed to list the ids of all {endpoint}")
+                ids.update(record["id"] for record in page)
+        finally:
+            remaining_pages.close()
+        return ids
+
+    def get_existing_ids(self, endpoint, ids):
+        """
+        The ids of records that exist, requested in batches with the include filter
+        """
+        existing = set()
+        for page in self._fetch_included(endpoint, ids, {**ID_SCAN_PARAMS[endpoint], "_fields": "id"}):
+            existing.update(record["id"] for record in page)
+        return existing
+
+    def _fetch_included(self, endpoint, ids, params):
+        """
+        Pages of the records with the given ids, batches of ids are requested concurrently with the include filter
+        """
+        ids = sorted(ids)
+        batches = [ids[i:i + INCLUDE_BATCH_SIZE] for i in range(0, len(ids), INCLUDE_BATCH_SIZE)]
+        params = {**params, "per_page": INCLUDE_BATCH_SIZE}
+        pages = ordered_parallel_map(
+            lambda batch: self._get_page(endpoint, {**params, "include": ",".join(map(str, batch))}, 1),
+            batches,
+            self.concurrency
+        )
+        try:
+            for page in pages:
+                if page is None:
+                    raise WooCommerceClientError(f"Failed to download {endpoint} by their ids")
+                yield page
+        finally:
+            pages.close()
+
+    def get_customers(self, per_page: int = RESULTS_PER_PAGE, checkpoint=None):
         """
         Get all customers
         """
         params = {"per_page": per_page, 'role': 'all'}
-        data = self._fetch_data("customers", params)
+        data = self._fetch_data("customers", params, checkpoint=checkpoint)
         return data
+
+    def get_customers_by_ids(self, customer_ids):
+        """
+        Get the customers with the given ids
+        """
+        return self._fetch_included("customers", customer_ids, {"role": "all"})
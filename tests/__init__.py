@@ -1,3 +1,20 @@
 import sys
 import os
-sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
\ No newline at end of file
+import json
+
+import mock
+import requests
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+
+
+def make_response(status_code=200, data=None, headers=None):
+    """
+    Response of the mocked session with the JSON body of data, responses with an error status raise on
+    raise_for_status like the responses of requests
+    """
+    response = mock.Mock(status_code=status_code, headers=headers or {}, content=json.dumps(data).encode("utf-8"))
+    response.json.return_value = data
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError(response=response)
+    return response
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+import mock
+import requests
+
+from cassette import Cassette, CassetteError, RECORD, REPLAY
+from woocommerce_cli import WooCommerceClient
+
+
+def make_response(status_code, body, headers):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers)
+    response._content = body.encode("utf-8")
+    response.encoding = "utf-8"
+    return response
+
+
+class TestCassette(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "cassette.jsonl.gz")
+
+    def record_customers(self):
+        pages = {1: '[{"id": 1}]', 2: '[{"id": 2}]'}
+        failures = [make_response(503, "", {"Retry-After": "0"})]
+
+        def get(endpoint, params):
+            if params.get("page") == 2 and failures:
+                return failures.pop()
+            return make_response(200, pages[params.get("page", 1)], {"X-WP-TotalPages": "2"})
+
+        cassette = Cassette(self.path, RECORD)
+        with mock.patch("woocommerce_cli.PooledAPI.get", side_effect=get):
+            client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False, cassette=cassette)
+            recorded = list(client.get_customers())
+        cassette.close()
+        return recorded
+
+    def test_replay_serves_recorded_pages_without_network(self):
+        recorded = self.record_customers()
+
+        with mock.patch("woocommerce_cli.PooledAPI.get") as get:
+            client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False,
+                                       cassette=Cassette(self.path, REPLAY))
+            replayed = list(client.get_customers())
+
+        get.assert_not_called()
+        self.assertEqual(replayed, recorded)
+        self.assertEqual(replayed, [[{"id": 1}], [{"id": 2}]])
+
+    def test_request_missing_in_cassette(self):
+        self.record_customers()
+        client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False,
+                                   cassette=Cassette(self.path, REPLAY))
+
+        with self.assertRaises(CassetteError):
+            list(client.get_customers(per_page=50))
+
+
+if __name__ == "__main__":
+    unittest.main()
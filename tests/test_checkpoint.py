@@ -0,0 +1,52 @@
+import datetime
+import unittest
+
+from checkpoint import ExtractionCheckpoint
+
+
+def day(n):
+    return datetime.datetime(2020, 1, n)
+
+
+class TestExtractionCheckpoint(unittest.TestCase):
+
+    def test_completed_windows_are_merged_and_skipped(self):
+        checkpoint = ExtractionCheckpoint("orders", "abc")
+        checkpoint.complete_window(day(1), day(3))
+        checkpoint.complete_window(day(3), day(5))
+        checkpoint.complete_window(day(7), day(8))
+
+        self.assertEqual(checkpoint.completed_windows, [(day(1), day(5)), (day(7), day(8))])
+        self.assertEqual(checkpoint.remaining_ranges(day(2), day(10)), [(day(5), day(7)), (day(8), day(10))])
+
+    def test_unfinished_download_is_resumed_with_its_period(self):
+        checkpoint = ExtractionCheckpoint("orders", "abc", date_from="2020-01-01T00:00:00",
+                                          date_to="2020-01-10T00:00:00")
+        checkpoint.complete_window(day(1), day(5))
+        previous = checkpoint.to_state()
+
+        resumed = ExtractionCheckpoint("orders", "abc", previous=previous, date_from="2020-01-02T00:00:00",
+                                       date_to="2020-01-11T00:00:00")
+        self.assertTrue(resumed.resumed)
+        self.assertEqual(resumed.date_from, "2020-01-01T00:00:00")
+        self.assertEqual(resumed.remaining_ranges(day(1), day(10)), [(day(5), day(10))])
+
+    def test_changed_configuration_starts_from_scratch(self):
+        previous = ExtractionCheckpoint("customers", "abc")
+        previous.complete_page(10)
+
+        checkpoint = ExtractionCheckpoint("customers", "def", previous=previous.to_state())
+        self.assertFalse(checkpoint.resumed)
+        self.assertEqual(checkpoint.completed_pages, 0)
+
+    def test_finished_download_is_not_resumed(self):
+        checkpoint = ExtractionCheckpoint("orders", "abc", date_to="2020-01-10T00:00:00")
+        checkpoint.finish()
+
+        state = checkpoint.to_state()
+        self.assertEqual(state, {"fingerprint": "abc", "finished": True})
+        self.assertFalse(ExtractionCheckpoint("orders", "abc", previous=state).resumed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,13 +3,67 @@ Created on 12. 11. 2018
 
 @author: esner
 '''
+import datetime
 import unittest
 import mock
 import os
+import tempfile
+import time
 from freezegun import freeze_time
+from kbc.env_handler import KBCEnvHandler
 
 from component import Component
 
+PARAMETERS = {
+    "store_url": "https://myshop.com",
+    "#consumer_key": "key",
+    "#consumer_secret": "secret",
+    "endpoint": ["Orders"]
+}
+MODIFIED_DATE_MODE = "Incremental Fetching with modified date"
+
+
+def make_component(parameters):
+    """
+    Component with the configuration parameters and a mocked client, the data folder is a new temporary folder
+    """
+    data_dir = tempfile.mkdtemp()
+
+    def init(self, mandatory_params, log_level=None, data_path=None):
+        self.cfg_params = parameters
+        self.data_path = data_dir
+        self.tables_out_path = os.path.join(data_dir, "out", "tables")
+
+    with mock.patch.object(KBCEnvHandler, "__init__", init), \
+            mock.patch.object(Component, "validate_config"), \
+            mock.patch.object(Component, "validate_image_parameters"), \
+            mock.patch.object(Component, "create_client"):
+        return Component()
+
+
+def run_component(component, state):
+    """
+    Runs the component with the state of the previous run, returns the state written by the run
+    """
+    component.get_state_file = mock.Mock(return_value=state)
+    component.write_state_file = mock.Mock()
+    component.create_manifests = mock.Mock()
+    component.run()
+    return component.write_state_file.call_args[0][0]
+
+
+def mock_download(component, endpoint, modified=None, finish=True):
+    """
+    Download of the endpoint writing a record modified at modified, the download is unfinished unless finish
+    """
+    def download(*args, checkpoint=None, **kwargs):
+        if modified:
+            component.track_modified_cursor(endpoint, {"id": 1, "date_modified_gmt": modified})
+        if checkpoint and finish:
+            checkpoint.finish()
+        return []
+    return mock.Mock(side_effect=download)
+
 
 class TestComponent(unittest.TestCase):
 
@@ -23,6 +77,199 @@ class TestComponent(unittest.TestCase):
             comp.run()
 
 
+class TestModifiedCursor(unittest.TestCase):
+
+    def test_modified_after_is_cursor_minus_lag(self):
+        component = make_component({**PARAMETERS, "modified_lag_minutes": 10})
+        cursors = {"orders": "2023-05-01T10:00:00"}
+
+        self.assertEqual(component.get_modified_after("orders", cursors), "2023-05-01T09:50:00")
+        self.assertIsNone(component.get_modified_after("products", cursors))
+
+    def test_cursor_follows_latest_modification(self):
+        component = make_component(PARAMETERS)
+        for record in [{"id": 1, "date_modified_gmt": "2023-05-01T10:00:00"},
+                       {"id": 2, "date_modified_gmt": "2023-04-01T10:00:00"},
+                       {"id": 3}]:
+            component.track_modified_cursor("orders", record)
+
+        self.assertEqual(component.modified_cursors, {"orders": "2023-05-01T10:00:00"})
+
+    @freeze_time("2023-05-02 08:00:00")
+    def test_cursor_is_at_most_run_start(self):
+        component = make_component(PARAMETERS)
+        # modified after the run started, records modified earlier may have been fetched before their change
+        component.track_modified_cursor("orders", {"id": 1, "date_modified_gmt": "2023-05-02T09:30:00"})
+
+        self.assertEqual(component.modified_cursors, {"orders": "2023-05-02T08:00:00"})
+
+    def test_run_continues_from_cursor_in_gmt(self):
+        component = make_component({**PARAMETERS, "fetching_mode": MODIFIED_DATE_MODE})
+        component.download_orders = mock_download(component, "orders", modified="2023-05-02T08:00:00")
+
+        state = run_component(component, {"modified_cursors": {"orders": "2023-05-01T10:00:00"}})
+
+        args, kwargs = component.download_orders.call_args
+        self.assertEqual(args[3:5], ("modified_after", "2023-05-01T09:55:00"))
+        self.assertTrue(kwargs["dates_are_gmt"])
+        self.assertEqual(state["modified_cursors"], {"orders": "2023-05-02T08:00:00"})
+
+    def test_first_run_downloads_all_data(self):
+        component = make_component({**PARAMETERS, "fetching_mode": MODIFIED_DATE_MODE})
+        component.download_orders = mock_download(component, "orders", modified="2023-05-02T08:00:00")
+
+        state = run_component(component, {})
+
+        self.assertIsNone(component.download_orders.call_args[0][4])
+        self.assertEqual(state["modified_cursors"], {"orders": "2023-05-02T08:00:00"})
+
+    def test_unfinished_download_keeps_previous_cursor(self):
+        component = make_component({**PARAMETERS, "fetching_mode": MODIFIED_DATE_MODE,
+                                    "additional_options": {"resumable_extraction": True}})
+        component.download_orders = mock_download(component, "orders", modified="2023-05-02T08:00:00", finish=False)
+
+        state = run_component(component, {"modified_cursors": {"orders": "2023-05-01T10:00:00"}})
+
+        self.assertEqual(state["modified_cursors"], {"orders": "2023-05-01T10:00:00"})
+
+    def test_unfinished_first_download_stores_no_cursor(self):
+        component = make_component({**PARAMETERS, "fetching_mode": MODIFIED_DATE_MODE,
+                                    "additional_options": {"resumable_extraction": True}})
+        component.download_orders = mock_download(component, "orders", modified="2023-05-02T08:00:00", finish=False)
+
+        state = run_component(component, {})
+
+        self.assertEqual(state["modified_cursors"], {})
+
+
+class TestParallelEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.component = make_component({**PARAMETERS, "additional_options": {"parallel_endpoints": True}})
+        self.clients = []
+
+        def create_client(authenticate=True):
+            client = mock.Mock()
+            self.clients.append(client)
+            return client
+
+        self.component.create_client = create_client
+
+    @staticmethod
+    def download(name, delay):
+        def run(client):
+            time.sleep(delay)
+            return [(name, client)]
+        return run
+
+    def test_results_keep_endpoint_order(self):
+        results = self.component.run_downloads([("Orders", self.download("orders", 0.2)),
+                                                ("Products", self.download("products", 0)),
+                                                ("Customers", self.download("customers", 0.1))])
+
+        self.assertEqual([name for [(name, _)] in results], ["orders", "products", "customers"])
+
+    def test_each_download_has_its_own_client(self):
+        results = self.component.run_downloads([("Orders", self.download("orders", 0)),
+                                                ("Products", self.download("products", 0))])
+
+        self.assertEqual([client for [(_, client)] in results], self.clients)
+        self.assertEqual(len(set(map(id, self.clients))), 2)
+        self.assertNotIn(self.component.client, self.clients)
+        for client in self.clients:
+            client.close.assert_called_once()
+
+    def test_clients_are_closed_when_download_fails(self):
+        def fail(client):
+            raise RuntimeError("store unavailable")
+
+        with self.assertRaises(RuntimeError):
+            self.component.run_downloads([("Orders", fail), ("Products", self.download("products", 0))])
+
+        self.assertEqual(len(self.clients), 2)
+        for client in self.clients:
+            client.close.assert_called_once()
+
+    def test_single_download_uses_component_client(self):
+        results = self.component.run_downloads([("Orders", self.download("orders", 0))])
+
+        self.assertEqual(results, [[("orders", self.component.client)]])
+        self.assertEqual(self.clients, [])
+
+
+class TestIncrementalCustomers(unittest.TestCase):
+
+    def setUp(self):
+        self.component = make_component({
+            **PARAMETERS,
+            "endpoint": ["Orders", "Customers"],
+            "additional_options": {"incremental_customers": True, "customers_full_sweep_days": 7}
+        })
+
+        def download_orders(*args, **kwargs):
+            self.component.order_customer_ids.update([5, 7])
+            return []
+
+        self.component.download_orders = mock.Mock(side_effect=download_orders)
+        self.component.download_customers = mock.Mock(return_value=[])
+
+    @staticmethod
+    def days_ago(days):
+        return (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat()
+
+    def test_changed_customers_only_after_recent_sweep(self):
+        endpoints = ["Orders", "Customers"]
+
+        self.assertTrue(self.component.changed_customers_only(endpoints, {"customers_full_sweep": self.days_ago(1)}))
+        self.assertFalse(self.component.changed_customers_only(endpoints, {}))
+        self.assertFalse(self.component.changed_customers_only(endpoints, {"customers_full_sweep": self.days_ago(8)}))
+        self.assertFalse(self.component.changed_customers_only(["Customers"],
+                                                               {"customers_full_sweep": self.days_ago(1)}))
+
+    def test_first_run_downloads_all_customers(self):
+        state = run_component(self.component, {})
+
+        self.assertNotIn("customer_ids", self.component.download_customers.call_args[1])
+        self.assertEqual(state["customers_full_sweep"], self.component.extraction_time)
+
+    def test_next_run_downloads_customers_of_orders(self):
+        last_sweep = self.days_ago(1)
+
+        state = run_component(self.component, {"customers_full_sweep": last_sweep})
+
+        self.assertEqual(self.component.download_customers.call_args[1]["customer_ids"], {5, 7})
+        self.assertEqual(state["customers_full_sweep"], last_sweep)
+
+    def test_unfinished_sweep_is_repeated(self):
+        self.component.resumable = True
+
+        state = run_component(self.component, {})
+
+        self.assertIsNone(state["customers_full_sweep"])
+
+
+class TestPaginationDrift(unittest.TestCase):
+
+    def test_repeated_records_are_dropped(self):
+        component = make_component(PARAMETERS)
+
+        self.assertEqual(component.drop_repeated("orders", [{"id": 1}, {"id": 2}]), [{"id": 1}, {"id": 2}])
+        self.assertEqual(component.drop_repeated("orders", [{"id": 2}, {"id": 3}]), [{"id": 3}])
+        # the ids of other endpoints are separate
+        self.assertEqual(component.drop_repeated("products", [{"id": 2}]), [{"id": 2}])
+        self.assertEqual(component.metrics.get("orders", "drifted"), 1)
+        self.assertEqual(component.metrics.get("products", "drifted"), 0)
+
+    def test_drift_is_reported(self):
+        component = make_component(PARAMETERS)
+        component.drop_repeated("orders", [{"id": 1}, {"id": 1}])
+
+        with self.assertLogs(level="WARNING") as logs:
+            component.report_download("orders")
+
+        self.assertIn("1 orders shifted between pages", logs.output[0])
+
+
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
@@ -0,0 +1,82 @@
+import datetime
+import unittest
+
+from fingerprints import FingerprintStore, record_hash
+
+
+def write(store, record):
+    """
+    Writes the record unless it is unchanged, like the writers, returns whether it was written
+    """
+    fingerprint = record_hash(record)
+    if store.unchanged(record["id"], fingerprint):
+        return False
+    store.update(record["id"], fingerprint)
+    return True
+
+
+class TestFingerprintStore(unittest.TestCase):
+
+    def test_unchanged_records_are_skipped_by_next_run(self):
+        store = FingerprintStore("customers")
+        self.assertTrue(write(store, {"id": 1, "email": "a@example.com"}))
+        self.assertTrue(write(store, {"id": 2, "email": "b@example.com"}))
+
+        store = FingerprintStore.from_state("customers", store.to_state())
+
+        self.assertFalse(write(store, {"email": "a@example.com", "id": 1}))
+        self.assertTrue(write(store, {"id": 2, "email": "c@example.com"}))
+        self.assertTrue(write(store, {"id": 3, "email": "d@example.com"}))
+        self.assertEqual(store.skipped, 1)
+
+        store = FingerprintStore.from_state("customers", store.to_state())
+
+        self.assertFalse(write(store, {"id": 2, "email": "c@example.com"}))
+
+    def test_records_are_not_forgotten_between_runs(self):
+        store = FingerprintStore("products")
+        write(store, {"id": 1})
+        # a run that does not see the record
+        state = FingerprintStore.from_state("products", store.to_state()).to_state()
+
+        store = FingerprintStore.from_state("products", state)
+
+        self.assertFalse(write(store, {"id": 1}))
+
+    def test_record_failed_to_write_is_not_skipped(self):
+        store = FingerprintStore("customers")
+        # the writer stores the hash only after the record is written
+        store.unchanged(1, record_hash({"id": 1}))
+
+        store = FingerprintStore.from_state("customers", store.to_state())
+
+        self.assertTrue(write(store, {"id": 1}))
+
+    def test_records_with_integers_over_64_bits_are_hashed(self):
+        record = {"id": 1, "meta_data": [{"key": "big", "value": 2 ** 70}]}
+
+        self.assertEqual(record_hash(record), record_hash(dict(reversed(list(record.items())))))
+        self.assertNotEqual(record_hash(record), record_hash({**record, "meta_data": []}))
+
+    def test_store_is_bounded(self):
+        store = FingerprintStore("products", max_records=10)
+        for record_id in range(20, 0, -1):
+            write(store, {"id": record_id})
+
+        store = FingerprintStore.from_state("products", store.to_state())
+
+        self.assertEqual(list(store.ids), list(range(1, 11)))
+
+    def test_store_is_dropped_after_refresh_period(self):
+        created = datetime.datetime.now() - datetime.timedelta(days=8)
+        store = FingerprintStore("customers", created=created.isoformat())
+        write(store, {"id": 1})
+
+        store = FingerprintStore.from_state("customers", store.to_state(), refresh_days=7)
+
+        self.assertTrue(write(store, {"id": 1}))
+        self.assertEqual(list(FingerprintStore.from_state("customers", store.to_state()).ids), [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
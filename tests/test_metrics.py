@@ -0,0 +1,74 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import mock
+import requests
+import urllib3
+
+from tests import make_response
+from metrics import RunMetrics, metrics_endpoint
+from woocommerce_cli import WooCommerceClient
+
+
+class TestClientMetrics(unittest.TestCase):
+
+    def test_requests_retries_and_throttling_are_counted(self):
+        metrics = RunMetrics()
+        client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False, metrics=metrics)
+        responses = [make_response(data=[{"id": 1}]), make_response(429, headers={"Retry-After": "0"})]
+        client.session = mock.Mock(get=lambda endpoint, params: responses.pop())
+
+        self.assertEqual(list(client.get_product_variations(15)), [[{"id": 1}]])
+
+        counters = metrics.report()["endpoints"]["products/variations"]
+        self.assertEqual((counters["requests"], counters["retries"], counters["throttled"]), (2, 1, 1))
+        self.assertEqual(counters["bytes"], len(b'[{"id": 1}]') + len(b"null"))
+        self.assertIn("decode_seconds", counters)
+
+    def test_compressed_bytes_are_counted(self):
+        metrics = RunMetrics()
+        client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False, metrics=metrics)
+        body = gzip.compress(json.dumps([{"id": i, "status": "completed"} for i in range(100)]).encode("utf-8"))
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = urllib3.HTTPResponse(io.BytesIO(body), headers={"Content-Encoding": "gzip"},
+                                            preload_content=False)
+        # the session reads the content before returning the response
+        self.assertGreater(len(response.content), len(body))
+        client.session = mock.Mock(get=lambda endpoint, params: response)
+
+        client._request("orders", {})
+
+        self.assertEqual(metrics.get("orders", "bytes"), len(body))
+
+
+class TestRunMetrics(unittest.TestCase):
+
+    def test_record_ids_are_not_separate_endpoints(self):
+        self.assertEqual(metrics_endpoint("products/15/variations"), "products/variations")
+        self.assertEqual(metrics_endpoint("orders"), "orders")
+
+    def test_report_is_written_with_manifest(self):
+        out_dir = tempfile.mkdtemp()
+        metrics = RunMetrics()
+        metrics.add("orders", records=2)
+        with metrics.timer("orders", "write"):
+            pass
+
+        report_path = os.path.join(out_dir, "run_metrics.json")
+        metrics.write_report(report_path, {"order.csv": 2})
+
+        with open(report_path) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(report["table_rows"], {"order.csv": 2})
+        self.assertEqual(report["endpoints"]["orders"]["records"], 2)
+        self.assertGreater(report["peak_rss_mb"], 0)
+        self.assertTrue(os.path.exists(f"{report_path}.manifest"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+
+import mock
+import requests
+
+from tests import make_response
+from page_tuner import PageSizeTuner, MAX_TIMEOUT, MIN_TIMEOUT
+from woocommerce_cli import WooCommerceClient
+
+
+class TestPageSizeTuner(unittest.TestCase):
+
+    def test_fast_pages_grow_up_to_maximum(self):
+        tuner = PageSizeTuner("orders", 100, max_page_size=500)
+        for _ in range(5):
+            tuner.observe(tuner.per_page, 0.5)
+
+        self.assertEqual(tuner.per_page, 500)
+
+    def test_pages_close_to_timeout_shrink(self):
+        tuner = PageSizeTuner("orders", 100)
+        for _ in range(10):
+            tuner.observe(100, 5.0)
+        # the timeout is now 4 * 5 s, a page of 15 s is too close to it
+        tuner.observe(100, 15.0)
+
+        self.assertEqual(tuner.per_page, 50)
+
+    def test_timeout_follows_p95_latency(self):
+        tuner = PageSizeTuner("orders", 100)
+        self.assertEqual(tuner.timeout, MAX_TIMEOUT)
+
+        # partial pages are measured without resizing
+        for _ in range(10):
+            tuner.observe(50, 0.05)
+        self.assertEqual(tuner.timeout, MIN_TIMEOUT)
+
+        for _ in range(50):
+            tuner.observe(50, 5.0)
+        # 4 * 0.1 s per record * 100 records
+        self.assertAlmostEqual(tuner.timeout, 40.0)
+
+
+class TestAdaptiveFetch(unittest.TestCase):
+
+    def test_timed_out_pages_are_split(self):
+        client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False,
+                                   adaptive_page_size=True)
+        requested = []
+
+        def get(endpoint, params, timeout=None):
+            if params["per_page"] == 500:
+                return make_response(400, data={"code": "rest_invalid_param"})
+            if params["per_page"] == 1:
+                return make_response(data=[{"id": 0}], headers={"X-WP-Total": "100"})
+            requested.append((params["offset"], params["per_page"]))
+            if params["per_page"] > 25:
+                raise requests.exceptions.ReadTimeout()
+            first = params["offset"]
+            return make_response(data=[{"id": i} for i in range(first, first + params["per_page"])])
+
+        client.session = mock.Mock(get=get)
+        ids = [record["id"] for page in client.get_customers() for record in page]
+
+        self.assertEqual(ids, list(range(100)))
+        self.assertEqual(client.page_tuners["customers"].per_page, 25)
+        self.assertIn((25, 25), requested)
+
+    def test_dropped_connection_is_retried(self):
+        client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False,
+                                   adaptive_page_size=True)
+        failures = [requests.exceptions.ConnectionError("Connection reset by peer")]
+
+        def get(endpoint, params, timeout=None):
+            if params["per_page"] == 500:
+                return make_response(400, data={"code": "rest_invalid_param"})
+            if params["per_page"] == 1:
+                return make_response(data=[{"id": 0}], headers={"X-WP-Total": "20"})
+            if failures:
+                raise failures.pop()
+            first = params["offset"]
+            return make_response(data=[{"id": i} for i in range(first, min(first + params["per_page"], 20))])
+
+        client.session = mock.Mock(get=get)
+        with mock.patch("time.sleep"):
+            ids = [record["id"] for page in client.get_customers() for record in page]
+
+        self.assertEqual(ids, list(range(20)))
+
+    def test_pages_capped_by_store_are_completed(self):
+        client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False,
+                                   adaptive_page_size=True)
+
+        def get(endpoint, params, timeout=None):
+            if params["per_page"] == 500:
+                return make_response(400, data={"code": "rest_invalid_param"})
+            if params["per_page"] == 1:
+                return make_response(data=[{"id": 0}], headers={"X-WP-Total": "250"})
+            # the store returns at most 40 records whatever per_page says
+            first = params["offset"]
+            return make_response(data=[{"id": i} for i in range(first, min(first + min(params["per_page"], 40), 250))])
+
+        client.session = mock.Mock(get=get)
+        ids = [record["id"] for page in client.get_customers() for record in page]
+
+        self.assertEqual(ids, list(range(250)))
+        self.assertEqual(client.page_tuners["customers"].max_page_size, 40)
+
+    def test_probe_detects_capped_pages(self):
+        client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False)
+
+        def get(endpoint, params, timeout=None):
+            return make_response(data=[{"id": i} for i in range(min(params["per_page"], 200))],
+                                 headers={"X-WP-Total": "1000"})
+
+        client.session = mock.Mock(get=get)
+
+        self.assertEqual(client._probe_max_page_size("orders", {}), 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
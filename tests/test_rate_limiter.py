@@ -0,0 +1,73 @@
+import time
+import unittest
+
+import mock
+
+from rate_limiter import AdaptiveRateLimiter, MIN_RATE
+from woocommerce_cli import WooCommerceClient
+
+
+class TestAdaptiveRateLimiter(unittest.TestCase):
+
+    def test_rate_grows_while_healthy(self):
+        limiter = AdaptiveRateLimiter(max_rate=10, initial_rate=2)
+        for _ in range(50):
+            limiter.on_response(200, 0.1)
+
+        self.assertEqual(limiter.rate, 10)
+
+    def test_throttling_halves_rate_once_per_overload(self):
+        limiter = AdaptiveRateLimiter(max_rate=10, initial_rate=8)
+        # concurrent requests failing together
+        for _ in range(4):
+            limiter.on_response(429, 0.1)
+
+        self.assertEqual(limiter.rate, 4)
+
+    def test_rate_drops_when_latency_grows(self):
+        limiter = AdaptiveRateLimiter(max_rate=10, initial_rate=10)
+        for _ in range(20):
+            limiter.on_response(200, 0.1)
+        for _ in range(10):
+            limiter.on_response(200, 2.0)
+
+        self.assertLess(limiter.rate, 10)
+        self.assertGreaterEqual(limiter.rate, MIN_RATE)
+
+    def test_retry_after_pauses_all_requests(self):
+        limiter = AdaptiveRateLimiter(max_rate=100)
+        limiter.on_response(429, 0.1, retry_after=0.2)
+
+        start = time.monotonic()
+        limiter.acquire()
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_requests_are_paced(self):
+        limiter = AdaptiveRateLimiter(max_rate=20, initial_rate=20)
+        limiter.tokens = 0
+
+        start = time.monotonic()
+        for _ in range(4):
+            limiter.acquire()
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+
+class TestRateLimitedClient(unittest.TestCase):
+
+    def test_responses_are_reported_to_limiter(self):
+        limiter = mock.Mock()
+        client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False, rate_limiter=limiter)
+        client.session = mock.Mock()
+        client.session.get.return_value = mock.Mock(status_code=200, headers={"Retry-After": "3"}, content=b"[]")
+
+        client._get("orders", {"page": 1})
+
+        limiter.acquire.assert_called_once_with()
+        status_code, _, retry_after = limiter.on_response.call_args.args
+        self.assertEqual((status_code, retry_after), (200, 3.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
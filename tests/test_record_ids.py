@@ -0,0 +1,69 @@
+import unittest
+
+import mock
+
+from tests import make_response
+from record_ids import IdSet, MAX_BITMAP_ID, decode_ids, encode_ids
+from woocommerce_cli import WooCommerceClient
+
+
+class TestEncodeIds(unittest.TestCase):
+
+    def test_ids_survive_round_trip(self):
+        ids = set(range(1, 100000)) - {5, 77, 5000} | {2 ** 40}
+        self.assertEqual(decode_ids(encode_ids(ids)), ids)
+        self.assertEqual(decode_ids(encode_ids(set())), set())
+
+    def test_sequential_ids_are_compact(self):
+        self.assertLess(len(encode_ids(range(1, 100001))), 2000)
+
+
+class TestIdSet(unittest.TestCase):
+
+    def test_repeated_ids_are_reported(self):
+        ids = IdSet()
+        added = [ids.add(record_id) for record_id in [5, 70000, 5, 0, MAX_BITMAP_ID, "x", MAX_BITMAP_ID, 70000, 6]]
+        self.assertEqual(added, [False, False, True, False, False, False, True, True, False])
+
+    def test_bitmap_takes_bit_per_id(self):
+        ids = IdSet()
+        for record_id in range(800000):
+            ids.add(record_id)
+        self.assertLessEqual(len(ids.bitmap), 200000)
+
+
+class TestIdScan(unittest.TestCase):
+
+    def setUp(self):
+        self.client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False, concurrency=2)
+        self.requests = []
+
+    def test_ids_are_listed_in_largest_pages(self):
+        def get(endpoint, params):
+            self.requests.append(params)
+            if params["per_page"] == 500:
+                return make_response(400)
+            page = params["page"]
+            return make_response(data=[{"id": page * 10 + i} for i in range(2)], headers={"X-WP-TotalPages": "3"})
+
+        self.client.session = mock.Mock(get=get)
+
+        self.assertEqual(self.client.get_record_ids("customers"), {10, 11, 20, 21, 30, 31})
+        self.assertEqual({(p["per_page"], p["_fields"], p["role"]) for p in self.requests[1:]}, {(100, "id", "all")})
+
+    def test_existing_ids_are_checked_in_batches(self):
+        def get(endpoint, params):
+            self.requests.append(params)
+            ids = [int(record_id) for record_id in params["include"].split(",")]
+            return make_response(data=[{"id": record_id} for record_id in ids if record_id % 2])
+
+        self.client.session = mock.Mock(get=get)
+
+        existing = self.client.get_existing_ids("orders", range(250))
+
+        self.assertEqual(existing, set(range(1, 250, 2)))
+        self.assertEqual(len(self.requests), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
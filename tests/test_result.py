@@ -0,0 +1,87 @@
+import csv
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from result import BoundedFlattener, NdjsonWriter, OrdersWriter, OVERFLOW_COLUMN
+
+
+class TestBoundedFlattener(unittest.TestCase):
+
+    def test_nested_values_are_flattened_up_to_max_depth(self):
+        flattener = BoundedFlattener(max_depth=3)
+
+        row = flattener.flatten({"id": 1, "key": "_blob", "value": {"a": {"b": {"c": 1}}, "items": [1, 2]}})
+
+        self.assertEqual(row, {"id": 1, "key": "_blob", "value__a__b": '{"c": 1}', "value__items": "[1, 2]"})
+
+    def test_columns_over_limit_go_to_overflow(self):
+        flattener = BoundedFlattener(max_columns=3, known_columns=["value__old"])
+        flattener.flatten({"id": 1, "key": "a", "value": {"x": 1}})
+
+        row = flattener.flatten({"id": 2, "key": "b", "value": {"old": 2, "y": 3}})
+
+        self.assertEqual(row, {"id": 2, "key": "b", "value__old": 2, OVERFLOW_COLUMN: '{"value__y": 3}'})
+
+    def test_columns_of_previous_runs_count_toward_limit(self):
+        flattener = BoundedFlattener(max_columns=5)
+        flattener.flatten({"id": 1, "value": {"a": 1, "b": 2, "c": 3, "d": 4, "e": 5}})
+        header = flattener.known_columns | flattener.new_columns
+
+        # the next run knows the columns from the state
+        flattener = BoundedFlattener(max_columns=5, known_columns=header)
+        row = flattener.flatten({"id": 2, "value": {"a": 1, "f": 6}})
+
+        self.assertEqual(len(header), 5)
+        self.assertEqual(row, {"id": 2, "value__a": 1, OVERFLOW_COLUMN: '{"value__f": 6}'})
+
+
+class TestNdjsonWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.out_dir, "order.ndjson.gz")
+
+    def test_records_are_written_as_gzip_json_lines(self):
+        records = [{"id": 1, "line_items": [{"id": 11, "name": "Čaj"}]}, {"id": 2, "meta_data": []}]
+        with NdjsonWriter(self.out_dir, "order") as writer:
+            writer.write_all(records)
+
+        with gzip.open(self.path, "rt", encoding="utf-8") as lines:
+            self.assertEqual([json.loads(line) for line in lines], records)
+        self.assertEqual(writer.records, 2)
+        self.assertEqual(writer.collect_results(), [])
+
+    def test_integers_over_64_bits_are_written(self):
+        with NdjsonWriter(self.out_dir, "order") as writer:
+            writer.write({"id": 1, "total": 2 ** 70})
+
+        with gzip.open(self.path, "rt", encoding="utf-8") as lines:
+            self.assertEqual(json.loads(lines.readline()), {"id": 1, "total": 2 ** 70})
+
+    def test_manifest_has_tags(self):
+        with NdjsonWriter(self.out_dir, "order", tags=["raw"]):
+            pass
+
+        with open(f"{self.path}.manifest") as manifest:
+            self.assertEqual(json.load(manifest), {"tags": ["woocommerce", "order", "raw"], "is_permanent": False,
+                                                   "is_public": False})
+
+
+class TestRowCounts(unittest.TestCase):
+
+    def test_results_carry_the_rows_written(self):
+        out_dir = tempfile.mkdtemp()
+        with OrdersWriter(out_dir, "order", extraction_time="2023-01-01 00:00:00", file_headers={}) as writer:
+            writer.write({"id": 1, "line_items": [{"id": 11}, {"id": 12}]})
+            writer.write({"id": 2, "line_items": [{"id": 21, "taxes": [{"id": 5}]}]})
+
+        for result in writer.collect_results():
+            with open(result.full_path, newline="", encoding="utf-8") as table:
+                self.assertEqual(result.rows, sum(1 for _ in csv.reader(table)) - 1, os.path.basename(result.full_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import csv
+import gzip
+import os
+import tempfile
+import unittest
+
+from slicing import slice_table
+
+
+class TestSliceTable(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "order.csv")
+
+    def write_table(self, rows):
+        with open(self.path, "w", newline="", encoding="utf-8") as table:
+            writer = csv.writer(table)
+            writer.writerow(["id", "note"])
+            writer.writerows(rows)
+
+    def read_slices(self):
+        rows = []
+        for name in sorted(os.listdir(self.path)):
+            with gzip.open(os.path.join(self.path, name), "rt", newline="", encoding="utf-8") as table_slice:
+                rows.append(list(csv.reader(table_slice)))
+        return rows
+
+    def test_rows_are_split_into_headless_slices(self):
+        rows = [[str(i), f"multi\nline \"{i}\""] for i in range(10)]
+        self.write_table(rows)
+
+        header = slice_table(self.path, max_bytes=1024, max_rows=4)
+
+        self.assertEqual(header, ["id", "note"])
+        self.assertTrue(os.path.isdir(self.path))
+        self.assertEqual(sorted(os.listdir(self.path)), ["order_0001.csv.gz", "order_0002.csv.gz",
+                                                         "order_0003.csv.gz"])
+        self.assertEqual(self.read_slices(), [rows[:4], rows[4:8], rows[8:]])
+
+    def test_empty_table_has_one_empty_slice(self):
+        self.write_table([])
+
+        self.assertEqual(slice_table(self.path, max_bytes=1024), ["id", "note"])
+        self.assertEqual(self.read_slices(), [[]])
+
+
+if __name__ == "__main__":
+    unittest.main()
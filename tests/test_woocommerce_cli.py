@@ -0,0 +1,337 @@
+import datetime
+import time
+import unittest
+
+import mock
+import requests
+
+from tests import make_response
+from checkpoint import ExtractionCheckpoint
+from woocommerce_cli import HTTPSProtocolError, PooledAPI, UnauthorizedError, WooCommerceClient, \
+    decode_json, ordered_parallel_map, prefetch, release_records
+
+
+class TestOrderedParallelMap(unittest.TestCase):
+
+    def test_results_keep_input_order(self):
+        def slow_double(x):
+            # later items finish first
+            time.sleep((10 - x) * 0.001)
+            return x * 2
+
+        results = list(ordered_parallel_map(slow_double, range(10), workers=4))
+        self.assertEqual(results, [x * 2 for x in range(10)])
+
+    def test_single_worker_is_sequential(self):
+        calls = []
+        results = ordered_parallel_map(calls.append, range(3), workers=1)
+        next(results)
+        self.assertEqual(calls, [0])
+
+
+class TestPrefetch(unittest.TestCase):
+
+    def test_items_are_buffered_up_to_limit(self):
+        produced = []
+
+        def pages():
+            for page in range(10):
+                produced.append(page)
+                yield page
+
+        consumer = prefetch(pages(), max_size=3)
+        self.assertEqual(next(consumer), 0)
+        time.sleep(0.05)
+        # three buffered pages and one waiting for free space
+        self.assertLessEqual(len(produced), 5)
+        self.assertEqual(list(consumer), list(range(1, 10)))
+
+    def test_producer_error_is_raised_to_consumer(self):
+        def pages():
+            yield 1
+            raise requests.exceptions.HTTPError("500 Server Error")
+
+        consumer = prefetch(pages(), max_size=3)
+        self.assertEqual(next(consumer), 1)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            next(consumer)
+
+
+class TestDecoding(unittest.TestCase):
+
+    def test_body_with_bom_falls_back_to_requests(self):
+        response = requests.Response()
+        response._content = b'\xef\xbb\xbf[{"id": 1}]'
+        response.headers["Content-Type"] = "application/json"
+
+        self.assertEqual(decode_json(response), [{"id": 1}])
+
+    def test_records_are_released_in_page_order(self):
+        page = [{"id": 1}, {"id": 2}, {"id": 3}]
+        records = release_records(page)
+
+        self.assertEqual(next(records), {"id": 1})
+        self.assertEqual(page, [{"id": 3}, {"id": 2}])
+        self.assertEqual(list(records), [{"id": 2}, {"id": 3}])
+
+
+class TestDateWindowPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.start = datetime.datetime(2020, 1, 1)
+        # one record per hour over ten days
+        self.record_dates = [self.start + datetime.timedelta(hours=h) for h in range(240)]
+        self.client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False,
+                                        max_window_records=50)
+        self.client._count_records = self._count_records
+
+    def _records(self, params):
+        after = datetime.datetime.fromisoformat(params["after"])
+        before = datetime.datetime.fromisoformat(params["before"]) if "before" in params else datetime.datetime.max
+        return [d for d in self.record_dates if after < d < before]
+
+    def _count_records(self, endpoint, params):
+        return len(self._records(params))
+
+    def test_windows_are_bounded_and_cover_all_records(self):
+        end = self.start + datetime.timedelta(days=20)
+        windows = self.client.plan_date_windows("orders", {}, self.start, end)
+
+        counts = [self._count_records("orders", self.client._window_params({}, w)) for w in windows]
+        self.assertTrue(all(0 < count <= 50 for count in counts))
+        self.assertEqual(sum(counts), len(self.record_dates))
+        for (_, previous_end), (next_start, _) in zip(windows, windows[1:]):
+            self.assertLessEqual(previous_end, next_start)
+
+    def test_last_window_is_open_ended_without_end_date(self):
+        # the local time of a store east of UTC is ahead of the UTC time of the extraction
+        local_now = datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(hours=10)
+        self.record_dates = [local_now - datetime.timedelta(hours=h) for h in range(120)]
+        self.client._fetch_data = lambda endpoint, params, concurrency: [self._records(params)]
+
+        pages = list(self.client._fetch_date_windows("orders", {"after": self.record_dates[-1].isoformat(),
+                                                                "before": None}))
+
+        self.assertEqual(sorted(d for page in pages for d in page), sorted(self.record_dates))
+
+
+class TestPageRetry(unittest.TestCase):
+
+    def test_failed_page_is_retried_without_restarting(self):
+        client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False)
+        pages = {1: [{"id": 1}], 2: [{"id": 2}], 3: [{"id": 3}]}
+        failures = {2: [make_response(503, headers={"Retry-After": "0"})]}
+        requested_pages = []
+
+        def get(endpoint, params):
+            page = params.get("page", 1)
+            requested_pages.append(page)
+            if failures.get(page):
+                return failures[page].pop()
+            return make_response(data=pages[page], headers={"X-WP-TotalPages": "3"})
+
+        client.session = mock.Mock(get=get)
+        result = list(client.get_customers())
+
+        self.assertEqual(result, [pages[1], pages[2], pages[3]])
+        self.assertEqual(requested_pages, [1, 2, 2, 3])
+
+
+class TestCheckpointedFetch(unittest.TestCase):
+
+    def setUp(self):
+        self.client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False)
+        self.requested_pages = []
+
+        def get(endpoint, params):
+            page = params.get("page", 1)
+            self.requested_pages.append(page)
+            return make_response(data=[{"id": page}], headers={"X-WP-TotalPages": "4", "X-WP-Total": "4"})
+
+        self.client.session = mock.Mock(get=get)
+
+    def test_completed_pages_are_skipped(self):
+        previous = ExtractionCheckpoint("customers", "abc")
+        previous.complete_page(2)
+        checkpoint = ExtractionCheckpoint("customers", "abc", previous=previous.to_state())
+
+        result = list(self.client.get_customers(per_page=1, checkpoint=checkpoint))
+
+        self.assertEqual(result, [[{"id": 3}], [{"id": 4}]])
+        self.assertTrue(checkpoint.finished)
+
+    def test_download_stops_at_deadline(self):
+        checkpoint = ExtractionCheckpoint("customers", "abc", deadline=0)
+
+        result = list(self.client.get_customers(per_page=1, checkpoint=checkpoint))
+
+        self.assertEqual(result, [[{"id": 1}]])
+        self.assertFalse(checkpoint.finished)
+        self.assertEqual(checkpoint.completed_pages, 1)
+
+
+class TestFieldsProjection(unittest.TestCase):
+
+    def test_fields_are_sent_with_every_page(self):
+        client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False,
+                                   fields={"customers": ["id", "email"]})
+        client.session = mock.Mock()
+        client.session.get.return_value = make_response(data=[{"id": 1}], headers={"X-WP-TotalPages": "2"})
+
+        list(client.get_customers())
+
+        for call in client.session.get.call_args_list:
+            self.assertEqual(call.kwargs["params"]["_fields"], "id,email")
+
+    def test_record_count_probe_requests_only_id(self):
+        client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False,
+                                   fields={"orders": ["id", "total"]})
+        client.session = mock.Mock()
+        client.session.get.return_value = make_response(data=[{"id": 1}], headers={"X-WP-Total": "7"})
+
+        self.assertEqual(client._count_records("orders", {"per_page": 100}), 7)
+        self.assertEqual(client.session.get.call_args.kwargs["params"]["_fields"], "id")
+
+
+class TestProductVariations(unittest.TestCase):
+
+    def test_variations_are_paged_without_adaptive_page_size(self):
+        client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False,
+                                   adaptive_page_size=True)
+        client.session = mock.Mock()
+        client.session.get.return_value = make_response(data=[{"id": 51}], headers={"X-WP-TotalPages": "1"})
+
+        result = list(client.get_product_variations(5))
+
+        self.assertEqual(result, [[{"id": 51}]])
+        client.session.get.assert_called_once_with("products/5/variations", params={"per_page": 100, "page": 1})
+
+
+class TestStatusSharding(unittest.TestCase):
+
+    def setUp(self):
+        self.client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False, concurrency=3,
+                                        status_sharding=True)
+        self.orders = {"completed": list(range(1, 251)), "processing": [300, 301], "wc-custom": [400]}
+        self.requested_pages = []
+
+    def get(self, endpoint, params):
+        if endpoint == "reports/orders/totals":
+            return make_response(data=[{"slug": status, "total": 0} for status in self.orders] + [
+                {"slug": "failed", "total": 0}])
+        # urlencode sends None as a string, which WooCommerce rejects
+        self.assertNotIn(None, params.values())
+        orders = self.orders.get(params["status"], [])
+        start = (params["page"] - 1) * params["per_page"]
+        if params["per_page"] > 1:
+            self.requested_pages.append((params["status"], params["page"]))
+        return make_response(data=[{"id": order_id} for order_id in orders[start:start + params["per_page"]]],
+                             headers={"X-WP-Total": str(len(orders))})
+
+    def test_pages_of_largest_shards_come_first(self):
+        self.client.session = mock.Mock(get=self.get)
+
+        pages = list(self.client.get_orders(date_from="2020-01-01T00:00:00"))
+
+        self.assertEqual(sorted(record["id"] for page in pages for record in page),
+                         sorted(sum(self.orders.values(), [])))
+        self.assertEqual(self.requested_pages, [("completed", 1), ("completed", 2), ("completed", 3),
+                                                ("processing", 1), ("wc-custom", 1)])
+
+    def test_default_statuses_without_report(self):
+        def get(endpoint, params):
+            if endpoint == "reports/orders/totals":
+                return make_response(403)
+            return self.get(endpoint, params)
+
+        self.client.session = mock.Mock(get=get)
+
+        pages = list(self.client.get_orders())
+
+        self.assertEqual([len(page) for page in pages], [100, 100, 50, 2])
+
+    def test_dates_without_value_are_not_sent(self):
+        self.client.session = mock.Mock(get=self.get)
+
+        pages = list(self.client.get_orders(custom_incremental_field="modified_after",
+                                            custom_incremental_date="2020-01-01T00:00:00"))
+
+        self.assertEqual(len(pages), 5)
+
+
+class TestCustomersByIds(unittest.TestCase):
+
+    def test_customers_are_requested_in_include_batches(self):
+        client = WooCommerceClient("https://myshop.com", "key", "secret", authenticate=False, concurrency=4)
+        requested = []
+
+        def get(endpoint, params):
+            requested.append(params)
+            return make_response(data=[{"id": int(i)} for i in params["include"].split(",")])
+
+        client.session = mock.Mock(get=get)
+
+        pages = list(client.get_customers_by_ids({7, 3} | set(range(100, 250))))
+
+        self.assertEqual([len(page) for page in pages], [100, 52])
+        self.assertEqual(pages[0][:3], [{"id": 3}, {"id": 7}, {"id": 100}])
+        self.assertEqual({(p["role"], p["per_page"], p["page"]) for p in requested}, {("all", 100, 1)})
+
+
+class TestAuthentication(unittest.TestCase):
+
+    @mock.patch("woocommerce_cli.PooledAPI.get")
+    def test_authentication_requests_single_order_id(self, get):
+        get.return_value = make_response(data=[{"id": 1}])
+
+        WooCommerceClient("https://myshop.com", "key", "secret")
+
+        get.assert_called_once_with("orders", params={"per_page": 1, "_fields": "id"})
+
+    @mock.patch("woocommerce_cli.PooledAPI.get")
+    def test_invalid_credentials(self, get):
+        get.return_value = make_response(401, data={
+            "code": "woocommerce_rest_cannot_view",
+            "message": "Sorry, you cannot list resources.",
+            "data": {"status": 401}
+        })
+
+        with self.assertRaisesRegex(UnauthorizedError, "woocommerce_rest_cannot_view"):
+            WooCommerceClient("https://myshop.com", "key", "secret")
+
+    @mock.patch("woocommerce_cli.PooledAPI.get")
+    def test_invalid_certificate(self, get):
+        get.side_effect = requests.exceptions.SSLError("certificate verify failed")
+
+        with self.assertRaises(HTTPSProtocolError):
+            WooCommerceClient("https://myshop.com", "key", "secret")
+
+
+class TestPooledAPI(unittest.TestCase):
+
+    def test_basic_auth_is_sent_through_session(self):
+        api = PooledAPI("https://myshop.com", "key", "secret", version="wc/v3")
+        api.http_session.request = mock.Mock()
+
+        api.get("orders", params={"page": 2})
+
+        kwargs = api.http_session.request.call_args.kwargs
+        self.assertEqual(kwargs["url"], "https://myshop.com/wp-json/wc/v3/orders")
+        self.assertEqual(kwargs["auth"], ("key", "secret"))
+        self.assertEqual(kwargs["params"], {"page": 2})
+
+    def test_query_string_auth_does_not_modify_params(self):
+        api = PooledAPI("https://myshop.com", "key", "secret", query_string_auth=True)
+        api.http_session.request = mock.Mock()
+        params = {"page": 2}
+
+        api.get("orders", params=params)
+
+        kwargs = api.http_session.request.call_args.kwargs
+        self.assertIsNone(kwargs["auth"])
+        self.assertEqual(kwargs["params"], {"page": 2, "consumer_key": "key", "consumer_secret": "secret"})
+        self.assertEqual(params, {"page": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()